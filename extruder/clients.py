@@ -0,0 +1,85 @@
+from __future__ import (division, print_function, absolute_import)
+
+import threading
+
+from .scheduler import SCHEDULER
+
+# Clients for the remote services extruder talks to. Each is created the
+# first time it is asked for and reused after that, which matters most in a
+# long-running process like the extruder daemon.
+
+PYPI_XMLRPC = 'https://pypi.python.org/pypi'
+
+_anaconda_apis = {}
+
+# xmlrpc clients cannot be shared between threads, so each thread gets its
+# own.
+_pypi = threading.local()
+
+# A release on PyPI does not change once published, so what PyPI says about
+# one is kept for the life of the process, keyed by (method, pypi_name,
+# version).
+_pypi_releases = {}
+
+
+def get_anaconda_api(token=''):
+    """
+    Return an anaconda.org API client for ``token``, reusing one already
+    created for the same token.
+
+    Parameters
+    ----------
+
+    token : str, optional
+        anaconda.org API token. An empty string gives an anonymous client.
+    """
+    try:
+        return _anaconda_apis[token]
+    except KeyError:
+        pass
+
+    from binstar_client.utils import get_server_api
+
+    api = get_server_api(token)
+    _anaconda_apis[token] = api
+    return api
+
+
+def get_pypi_client():
+    """
+    Return an XML-RPC client for PyPI for use by the calling thread.
+    """
+    try:
+        return _pypi.client
+    except AttributeError:
+        pass
+
+    from six.moves import xmlrpc_client as xmlrpclib
+
+    _pypi.client = xmlrpclib.ServerProxy(PYPI_XMLRPC, allow_none=True)
+    return _pypi.client
+
+
+def pypi_release(method, name, version):
+    """
+    Information from PyPI about version ``version`` of package ``name``,
+    asked for only once per process.
+
+    Parameters
+    ----------
+
+    method : str
+        PyPI XML-RPC method to call: ``'release_data'`` for the release's
+        metadata or ``'release_urls'`` for its files.
+    """
+    key = (method, name, version)
+    try:
+        return _pypi_releases[key]
+    except KeyError:
+        pass
+
+    client = get_pypi_client()
+    result = SCHEDULER.call('pypi', method, getattr(client, method),
+                            name, version)
+    _pypi_releases[key] = result
+    return result
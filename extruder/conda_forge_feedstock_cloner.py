@@ -1,12 +1,177 @@
 from argparse import ArgumentParser
+from collections import namedtuple
+import json
 import os
-from time import sleep
 
 from warnings import warn
 from ruamel import yaml
-from github3 import login
-from github3.exceptions import ForbiddenError
-from git import Repo, GitCommandError
+
+from .scheduler import SCHEDULER
+
+# github3 and GitPython are imported where they are used so that the
+# command line tool starts quickly.
+
+
+GITHUB_GRAPHQL = 'https://api.github.com/graphql'
+GITHUB_CLONE_URL = 'https://github.com/{}/{}.git'
+
+# GitHub limits the number of nodes a single GraphQL query may touch; two
+# repository lookups per feedstock keeps a batch of this size well inside it.
+GRAPHQL_BATCH_SIZE = 100
+
+FeedstockStatus = namedtuple('FeedstockStatus', ['exists', 'empty', 'forked'])
+
+# Feedstocks generated by conda-smithy share most of their CI files, and
+# many share history. With a reference repository, each feedstock is first
+# fetched into one shared bare repository, and the clones borrow objects
+# from it (git alternates) instead of each keeping a full copy.
+#
+# Clones depend on the objects in the reference repository, so it must never
+# be garbage collected with pruning; use repack_reference to tidy it. The
+# repository is configured so that git does not do that by itself, e.g. in
+# the "git gc --auto" a fetch can start.
+
+
+def _status_query(feedstocks, github_user):
+    """
+    GraphQL query checking, for each feedstock, whether it exists on
+    conda-forge and whether ``github_user`` has a fork of it.
+    """
+    lines = ['query {']
+    for i, feedstock in enumerate(feedstocks):
+        name = json.dumps(feedstock)
+        lines.append('  upstream{}: repository(owner: "conda-forge", '
+                     'name: {}) {{ isEmpty }}'.format(i, name))
+        lines.append('  fork{}: repository(owner: {}, name: {}) '
+                     '{{ isFork parent {{ nameWithOwner }} }}'
+                     ''.format(i, json.dumps(github_user), name))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def feedstock_status(gh, feedstocks, github_user,
+                     batch_size=GRAPHQL_BATCH_SIZE):
+    """
+    Find out which feedstocks exist, are empty, or have already been forked,
+    using one GraphQL query per batch of feedstocks.
+
+    Parameters
+    ----------
+
+    gh : ``github3.GitHub``
+        Logged-in github session.
+    feedstocks : list of str
+        Names of the feedstock repositories, e.g. ``'astropy-feedstock'``.
+    github_user : str
+        Github user name of the account to which feedstocks are forked.
+    batch_size : int, optional
+        Number of feedstocks to check in each query.
+
+    Returns
+    -------
+
+    dict
+        Keys are the feedstock names, values are ``FeedstockStatus``.
+    """
+    status = {}
+    for start in range(0, len(feedstocks), batch_size):
+        batch = feedstocks[start:start + batch_size]
+        query = _status_query(batch, github_user)
+        response = SCHEDULER.call('github', 'graphql', gh.session.post,
+                                  GITHUB_GRAPHQL,
+                                  data=json.dumps({'query': query}))
+        response.raise_for_status()
+        result = response.json()
+
+        # A repository that does not exist shows up as a NOT_FOUND error
+        # alongside a null in the data; anything else is a real problem.
+        errors = [e for e in result.get('errors', [])
+                  if e.get('type') != 'NOT_FOUND']
+        if errors:
+            raise RuntimeError('Github GraphQL query failed: '
+                               '{}'.format(errors[0].get('message')))
+
+        data = result.get('data') or {}
+        for i, feedstock in enumerate(batch):
+            upstream = data.get('upstream{}'.format(i))
+            fork = data.get('fork{}'.format(i))
+            parent = (fork or {}).get('parent') or {}
+            forked = bool(fork and fork['isFork'] and
+                          parent.get('nameWithOwner') ==
+                          'conda-forge/' + feedstock)
+            status[feedstock] = FeedstockStatus(
+                exists=upstream is not None,
+                empty=bool(upstream and upstream['isEmpty']),
+                forked=forked)
+
+    return status
+
+
+def _keep_objects(store):
+    """
+    Stop git from ever garbage collecting, or pruning unreachable objects
+    from, the reference repository ``store``.
+    """
+    store.git.config('gc.auto', '0')
+    store.git.config('gc.pruneExpire', 'never')
+
+
+def add_to_reference(reference, feedstock, url):
+    """
+    Fetch a feedstock into the shared reference repository, creating the
+    repository if needed.
+
+    Each feedstock is a remote of the reference repository named after the
+    feedstock. Tags are not fetched, since feedstocks' tags would clash.
+
+    Parameters
+    ----------
+
+    reference : str
+        Path of the bare reference repository.
+    feedstock : str
+        Name of the feedstock, e.g. ``'astropy-feedstock'``.
+    url : str
+        URL to fetch the feedstock from.
+    """
+    from git import Repo
+
+    if os.path.isdir(reference):
+        store = Repo(reference)
+    else:
+        store = Repo.init(reference, bare=True)
+        _keep_objects(store)
+
+    if feedstock not in [r.name for r in store.remotes]:
+        store.git.remote('add', '--no-tags', feedstock, url)
+    store.git.fetch(feedstock)
+
+
+def repack_reference(reference, fetch=False):
+    """
+    Repack the shared reference repository into a single pack.
+
+    Objects that are no longer reachable from the reference repository are
+    kept, because clones that borrow from it may still need them.
+
+    Parameters
+    ----------
+
+    reference : str
+        Path of the bare reference repository.
+    fetch : bool, optional
+        If ``True``, fetch every feedstock first.
+    """
+    from git import Repo
+
+    store = Repo(reference)
+    # Also protects stores made before this was set when they were created.
+    _keep_objects(store)
+    if fetch:
+        store.git.fetch('--all')
+    store.git.pack_refs('--all')
+    store.git.repack('-a', '-d', '--keep-unreachable')
+    store.git.prune_packed()
 
 
 # Read in the yml file
@@ -14,33 +179,81 @@ from git import Repo, GitCommandError
 #   Try forking to users account
 #   Clone to remote directory
 #   Set up remotes in that repo
-def fork_and_clone(gh, packages, github_user, destination):
+def fork_and_clone(gh, packages, github_user, destination, status=None,
+                   reference=None):
+    """
+    Fork each package's conda-forge feedstock to ``github_user`` and clone
+    the fork into ``destination``.
+
+    If ``status``, as returned by `feedstock_status`, is given, feedstocks
+    that are missing or empty are skipped, and those already forked are
+    cloned, without making any github API calls for them.
+
+    If ``reference``, the path of a bare repository, is given, each
+    feedstock is fetched into it, and the clones borrow objects from it
+    instead of keeping their own copy.
+    """
+    from github3.exceptions import ForbiddenError
+    from git import Repo, GitCommandError
+
+    status = status or {}
     for pdict in packages:
         package = pdict['name']
         print('Working on feedstock for: {}'.format(package))
         feedstock = package.lower() + '-feedstock'
-        upstream_repo = gh.repository('conda-forge', feedstock)
-        if not upstream_repo:
+        known = status.get(feedstock)
+        if known is not None and not known.exists:
             warn('Feedstock repository not found for {}'.format(package))
             continue
-        try:
-            fork_repo = upstream_repo.create_fork()
-        except ForbiddenError:
-            # If the repo exists but is empty this is the error raised.
-            # Skip further processing.
+        if known is not None and known.empty:
             warn('Feedstock {} exists on conda-forge but is '
                  'empty.'.format(feedstock))
             continue
-        if not fork_repo:
-            warn('Could not fork feedstock {}'.format(feedstock))
-            continue
+
+        if known is not None and known.forked:
+            upstream_clone_url = GITHUB_CLONE_URL.format('conda-forge',
+                                                         feedstock)
+            fork_clone_url = GITHUB_CLONE_URL.format(github_user, feedstock)
+            print('    Fork of {} already exists for {}'.format(feedstock,
+                                                                github_user))
         else:
-            print(('    Forked {} to {} (or fork '
-                   'already existed)').format(feedstock, github_user))
+            upstream_repo = SCHEDULER.call('github', 'repository',
+                                           gh.repository,
+                                           'conda-forge', feedstock)
+            if not upstream_repo:
+                warn('Feedstock repository not found for {}'.format(package))
+                continue
+            try:
+                fork_repo = SCHEDULER.call('github', 'create_fork',
+                                           upstream_repo.create_fork)
+            except ForbiddenError:
+                # If the repo exists but is empty this is the error raised.
+                # Skip further processing.
+                warn('Feedstock {} exists on conda-forge but is '
+                     'empty.'.format(feedstock))
+                continue
+            if not fork_repo:
+                warn('Could not fork feedstock {}'.format(feedstock))
+                continue
+            else:
+                print(('    Forked {} to {} (or fork '
+                       'already existed)').format(feedstock, github_user))
+            upstream_clone_url = upstream_repo.clone_url
+            fork_clone_url = fork_repo.clone_url
 
         local_name = os.path.join(destination, feedstock)
+        clone_options = {}
+        if reference is not None:
+            if os.path.exists(local_name):
+                warn('Destination clone for {} already '
+                     'exists'.format(feedstock))
+                continue
+            add_to_reference(reference, feedstock, upstream_clone_url)
+            print('    Fetched {} into reference repository'.format(feedstock))
+            clone_options['reference'] = os.path.abspath(reference)
         try:
-            local_repo = Repo.clone_from(fork_repo.clone_url, local_name)
+            local_repo = Repo.clone_from(fork_clone_url, local_name,
+                                         **clone_options)
         except GitCommandError:
             warn('Destination clone for {} already exists'.format(feedstock))
             continue
@@ -49,7 +262,7 @@ def fork_and_clone(gh, packages, github_user, destination):
                                                                destination))
 
         upstream_remote = local_repo.create_remote('upstream',
-                                                   upstream_repo.clone_url)
+                                                   upstream_clone_url)
         print('    Added remote upstream to local repository')
         upstream_remote.fetch()
         print('    Fetched from upstream remote')
@@ -58,8 +271,6 @@ def fork_and_clone(gh, packages, github_user, destination):
         print('    Set tracking branch on master to the upstream remote')
         upstream_remote.pull()
         print('    Pulled in changes from upstream master')
-        # Sleep briefly between repos...
-        sleep(0.5)
 
 
 def main(arguments=None):
@@ -79,6 +290,12 @@ def main(arguments=None):
                         help=('github API token. May set '
                               'environmental variable GITHUB_TOKEN '
                               'instead.'))
+    parser.add_argument('--reference', default=None,
+                        help=('Bare git repository, created if needed, '
+                              'that every feedstock is fetched into and '
+                              'that the clones borrow objects from, to save '
+                              'disk space and download time. Tidy it with '
+                              'repack_feedstock_store, never with git gc.'))
 
     if arguments is None:
         args = parser.parse_args()
@@ -97,6 +314,8 @@ def main(arguments=None):
     if not token:
         raise RuntimeError('Set a github API token before running')
 
+    from github3 import login
+
     # Set up github and read the packages before we get started.
     gh = login(token=token)
 
@@ -109,7 +328,23 @@ def main(arguments=None):
     with open(args.packages_yaml) as f:
         packages = yaml.safe_load(f)
 
-    fork_and_clone(gh, packages, github_user, destination)
+    feedstocks = [p['name'].lower() + '-feedstock' for p in packages]
+    status = feedstock_status(gh, feedstocks, github_user)
+
+    fork_and_clone(gh, packages, github_user, destination, status=status,
+                   reference=args.reference)
+
+
+def repack_main(arguments=None):
+    parser = ArgumentParser('Repack the reference repository shared by '
+                            'feedstock clones.')
+    parser.add_argument('reference',
+                        help='Path of the reference repository.')
+    parser.add_argument('--fetch', action='store_true', default=False,
+                        help='Fetch every feedstock before repacking.')
+    args = parser.parse_args(arguments)
+
+    repack_reference(args.reference, fetch=args.fetch)
 
 
 if __name__ == '__main__':
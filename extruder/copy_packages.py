@@ -1,28 +1,88 @@
 from __future__ import print_function
 
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+from collections import namedtuple
 import os
+import re
+import time
 
 from ruamel import yaml
+from six import string_types
 
-from binstar_client.utils import get_server_api
-from binstar_client.errors import NotFound
+from .clients import get_anaconda_api
+from .package_info import compact_package, stream_package
+from .metrics import (REGISTRY, BUILDS_COPIED, BUILDS_REMOVED, BYTES_COPIED,
+                      BYTES_REMOVED, FAILURES, PACKAGES_PLANNED, STAGE_SECONDS)
+from .scheduler import SCHEDULER
+from .snapshots import default_snapshot_dir, open_snapshots
+from .timings import (default_timings_path, longest_first, timings_at,
+                      print_estimate)
 
-from conda.version import VersionOrder
+# anaconda-client and conda are imported where they are used so that the
+# command line tool starts quickly.
 
-__all__ = ['PackageCopier']
+__all__ = ['PackageCopier', 'ChannelPruner']
+
+# Number of copy requests to anaconda.org allowed in flight at once.
+DEFAULT_MAX_WORKERS = 4
+
+# Number of removals from a channel to make before checking that all of them
+# worked and moving on to the next batch.
+DEFAULT_BATCH_SIZE = 20
+
+# Python and numpy versions a build was made for, as encoded in its build
+# string, e.g. np111py27_0 or py36h2d5d4e5_1.
+_BUILD_PYTHON = re.compile(r'py(\d+)')
+_BUILD_NUMPY = re.compile(r'np(\d+)')
+# Build number at the end of a build string.
+_BUILD_NUMBER = re.compile(r'_(\d+)$')
+# Hash of the build's pinned dependencies that conda-build 3 puts before the
+# build number. It changes from one rebuild to the next.
+_BUILD_HASH = re.compile(r'h[0-9a-f]{7}$')
+
+# Reasons for removing builds from a channel when pruning.
+OLD_VERSION = 'old version'
+SUPERSEDED = 'superseded'
+UNSUPPORTED_PLATFORM = 'unsupported platform'
+
+# A build, or every build of a version if basename is None, to remove from a
+# channel.
+Removal = namedtuple('Removal',
+                     ['package', 'version', 'basename', 'reason', 'size'])
+
+
+def fetch_package(api, owner, name, stream=False):
+    """
+    Package information, in the compact form described in
+    `extruder.package_info`, for package ``name`` in channel ``owner``.
+
+    If ``stream`` is ``True`` the response is parsed as it arrives.
+    """
+    if stream:
+        return SCHEDULER.call('anaconda.org', 'package', stream_package,
+                              api, owner, name)
+
+    info = SCHEDULER.call('anaconda.org', 'package', api.package,
+                          owner, name)
+    return compact_package(info)
 
 
 class PackageCopier(object):
-    def __init__(self, source, destination, input_packages, token=''):
+    def __init__(self, source, destination, input_packages, token='',
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 platforms=None, pythons=None, numpy=None,
+                 package_filters=None, stream=False, timings=None,
+                 snapshot_dir=None):
         """
         Parameters
         ----------
 
         source : ``str``
             Name of source conda channel.
-        destination : ``str``
-            Name of destination conda channel.
+        destination : ``str`` or list of ``str``
+            Name of destination conda channel, or a list of names to copy
+            the same packages to several channels. The source channel is
+            only queried once however many destinations there are.
         input_package : ``dict``
             Dictionary in which keys are package names and values are either
             a string version number (e.g. ``'1.0.1'``) or ``None``, which
@@ -31,14 +91,145 @@ class PackageCopier(object):
             potentially need to be copied.
         token : ``str``, optional
             Token for conda API. Needed for the actual copy operation.
+        max_workers : ``int``, optional
+            Largest number of copies to run at the same time, across all
+            destinations.
+        platforms : list of ``str``, optional
+            Only copy builds for these subdirs, e.g. ``['linux-64',
+            'osx-64']``. ``noarch`` builds are always copied. ``None``, the
+            default, copies builds for every platform.
+        pythons : list of ``str``, optional
+            Only copy builds for these versions of python, written as in a
+            build string, e.g. ``['27', '36']``. Builds that do not depend on
+            a particular python are always copied.
+        numpy : list of ``str``, optional
+            Only copy builds for these versions of numpy, written as in a
+            build string, e.g. ``['111', '112']``. Builds that do not depend
+            on a particular numpy are always copied.
+        package_filters : ``dict``, optional
+            Per-package filters. Keys are package names, values are
+            dictionaries with any of the keys ``platforms``, ``pythons`` and
+            ``numpy``, which replace the corresponding filter for that
+            package.
+        stream : ``bool``, optional
+            If ``True``, parse package information from anaconda.org as it
+            arrives, keeping only the fields needed for planning, instead of
+            loading each full response into memory first.
+        timings : `extruder.timings.TimingStore`, optional
+            If given, the packages that took longest to copy in past runs
+            are copied first, and the time each copy takes is recorded.
+        snapshot_dir : ``str``, optional
+            Folder of channel snapshots, described in
+            `extruder.snapshots`. If given, package information is only
+            downloaded when it has changed since the last run.
+
+        Attributes
+        ----------
+
+        plans : ``dict``
+            Keys are the destination channels, values are the packages to
+            copy to that destination, in the same form as ``to_copy``.
+        to_copy : ``dict``
+            Packages to copy to the first (or only) destination.
         """
         self.source = source
-        self.destination = destination
+        if isinstance(destination, string_types):
+            self.destinations = [destination]
+        else:
+            self.destinations = list(destination)
+        self.destination = self.destinations[0]
         self.input_packages = input_packages
-        self.api = get_server_api(token)
-        self.to_copy = self._package_versions_to_copy()
+        self.max_workers = max_workers
+        self.filters = {'platforms': platforms,
+                        'pythons': pythons,
+                        'numpy': numpy}
+        self.package_filters = package_filters or {}
+        self.stream = stream
+        self.timings = timings
+
+        self.api = get_anaconda_api(token)
+        self.snapshots = open_snapshots(snapshot_dir, self.api,
+                                        stream=stream)
+        self._source_packages = {}
+        self.plans = {}
+        try:
+            for dest in self.destinations:
+                with STAGE_SECONDS.time(stage='plan'):
+                    self.plans[dest] = self._package_versions_to_copy(dest)
+                PACKAGES_PLANNED.inc(len(self.plans[dest]), destination=dest)
+        finally:
+            if self.snapshots is not None:
+                self.snapshots.save()
+        self.to_copy = self.plans[self.destination]
+
+    def _source_package(self, name):
+        """
+        Package information from the source channel, fetched only once no
+        matter how many destinations are planned.
+        """
+        try:
+            return self._source_packages[name]
+        except KeyError:
+            pass
+
+        package = self._fetch_package(self.source, name)
+        self._source_packages[name] = package
+        return package
+
+    def _fetch_package(self, owner, name):
+        """
+        Package information, in the compact form described in
+        `extruder.package_info`, for package ``name`` in channel ``owner``.
+        """
+        if self.snapshots is not None:
+            return self.snapshots.package(owner, name)
+        return fetch_package(self.api, owner, name, stream=self.stream)
+
+    def _filters_for(self, package):
+        filters = dict(self.filters)
+        filters.update(self.package_filters.get(package, {}))
+        return filters
+
+    def _is_filtered(self, package):
+        return any(v is not None for v in self._filters_for(package).values())
+
+    def _build_wanted(self, package, package_file):
+        """
+        Whether a build, described by its ``PackageFile``, passes the
+        platform, python and numpy filters.
+        """
+        filters = self._filters_for(package)
+
+        subdir = package_file.subdir
+        if (filters['platforms'] is not None and subdir != 'noarch' and
+                subdir not in filters['platforms']):
+            return False
+
+        build = package_file.build
+        for name, pattern in [('pythons', _BUILD_PYTHON),
+                              ('numpy', _BUILD_NUMPY)]:
+            wanted = filters[name]
+            match = pattern.search(build)
+            if wanted is not None and match and match.group(1) not in wanted:
+                return False
+
+        return True
+
+    def _builds_for_version(self, package, channel, version,
+                            filtered=False):
+        """
+        Basenames of the builds of ``version`` in ``channel``, which is the
+        compact package information. If ``filtered``, only builds that pass
+        the filters are included.
+        """
+        from conda.version import VersionOrder
+
+        version = VersionOrder(version)
+        return [f.basename for f in channel['files']
+                if version == VersionOrder(f.version) and
+                (not filtered or self._build_wanted(package, f))]
 
-    def _package_versions_to_copy(self):
+    def _package_versions_to_copy(self, destination):
         """
         Determine which version of each package in packages
         should be copied from conda channel source to channel
@@ -50,6 +241,9 @@ class PackageCopier(object):
             Dictionary whose keys are the packages that actually need to be
             copied and whose values are the version to be copied.
         """
+        from binstar_client.errors import NotFound
+        from conda.version import VersionOrder
+
         packages = self.input_packages
 
         copy_versions = {}
@@ -60,7 +254,7 @@ class PackageCopier(object):
             # and triggers a comparison of file names. Technically, it could
             # be omitted, but seems more likely to be clear to future me.
             check_builds = False
-            cf = self.api.package(self.source, p)
+            cf = self._source_package(p)
             cf_version = VersionOrder(cf['latest_version'])
 
             if version is not None:
@@ -77,7 +271,7 @@ class PackageCopier(object):
                     raise RuntimeError(err)
 
             try:
-                ap = self.api.package(self.destination, p)
+                ap = self._fetch_package(destination, p)
             except NotFound:
                 need_to_copy = True
                 ap_version = None
@@ -102,28 +296,34 @@ class PackageCopier(object):
                     copy_builds = \
                         self._check_for_missing_builds(cf,
                                                        ap,
-                                                       check_version)
+                                                       check_version,
+                                                       package=p)
                     need_to_copy = len(copy_builds) > 0
+
+            copy_version = str(pinned_version or cf_version)
+            if need_to_copy and not copy_builds and self._is_filtered(p):
+                # Rather than copying every build of the version, copy only
+                # the builds that pass the filters, if there are any.
+                copy_builds = self._builds_for_version(p, cf, copy_version,
+                                                       filtered=True)
+                need_to_copy = len(copy_builds) > 0
             if need_to_copy:
-                copy_versions[p] = (str(cf_version), copy_builds)
+                copy_versions[p] = (copy_version, copy_builds)
 
         return copy_versions
 
-    def _check_for_missing_builds(self, source, dest, version):
+    def _check_for_missing_builds(self, source, dest, version, package=None):
         """
         For two packages that have the same version, see if there are any
         files on the source that are not on the destination.
 
         source and dest are both conda channels, and version
-        should be a string.
+        should be a string. If ``package`` is given, only source files
+        that pass the filters for that package are considered.
         """
-        def files_for_version(channel, version):
-            files = [f['basename'] for f in channel['files']
-                     if VersionOrder(version) == VersionOrder(f['version'])]
-            return files
-
-        source_files = files_for_version(source, version)
-        destination_files = files_for_version(dest, version)
+        source_files = self._builds_for_version(package, source, version,
+                                                filtered=package is not None)
+        destination_files = self._builds_for_version(package, dest, version)
 
         need_to_copy = [src for src in source_files
                         if src not in destination_files]
@@ -132,21 +332,297 @@ class PackageCopier(object):
 
     def copy_packages(self):
         """
-        Actually do the copying of the packages.
+        Actually do the copying of the packages, to every destination.
+
+        All of the copies are run by one pool of at most ``max_workers``
+        threads. Once all of the copies have finished, each one that failed
+        is printed and, if there were any, a ``RuntimeError`` is raised.
         """
-        for p, v in self.to_copy.items():
-            version, buildnames = v
-            if not buildnames:
-                # Copy all of the builds for this version
-                self.api.copy(self.source, p, version, to_owner=self.destination)
-            else:
-                for build in buildnames:
-                    self.api.copy(self.source, p, version,
-                                  basename=build,
-                                  to_owner=self.destination)
+        from concurrent.futures import ThreadPoolExecutor
+
+        tasks = []
+        for dest in self.destinations:
+            for p, v in self.plans[dest].items():
+                version, buildnames = v
+                if not buildnames:
+                    # Copy all of the builds for this version
+                    tasks.append((dest, p, version, None))
+                else:
+                    for build in buildnames:
+                        tasks.append((dest, p, version, build))
 
+        if self.timings is not None:
+            estimates = self.timings.estimates('copy',
+                                               set(t[1] for t in tasks))
+            order = longest_first(range(len(tasks)),
+                                  dict((i, estimates[t[1]])
+                                       for i, t in enumerate(tasks)
+                                       if t[1] in estimates))
+            tasks = [tasks[i] for i in order]
+            print_estimate('copy', [t[1] for t in tasks], estimates,
+                           self.max_workers)
 
-def main(arguments=None):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._copy_one, *task)
+                       for task in tasks]
+
+        failed = []
+        for (dest, package, version, basename), future in zip(tasks, futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(package)
+                print('Copying {} {} ({}) to {} failed: {}: {}'.format(
+                    package, version, basename or 'all builds', dest,
+                    type(e).__name__, e))
+
+        if failed:
+            raise RuntimeError('{} of {} copies failed, of {}'.format(
+                len(failed), len(tasks), ', '.join(sorted(set(failed)))))
+
+    def _copy_one(self, destination, package, version, basename):
+        """
+        Copy one build, or all builds if ``basename`` is ``None``, of a
+        version of a package to ``destination``.
+        """
+        if basename is None:
+            copied = self._builds_for_version(package,
+                                              self._source_packages[package],
+                                              version)
+        else:
+            copied = [basename]
+        sizes = dict((f.basename, f.size)
+                     for f in self._source_packages[package]['files'])
+
+        kwargs = {'to_owner': destination}
+        if basename is not None:
+            kwargs['basename'] = basename
+        start = time.time()
+        ok = False
+        try:
+            with STAGE_SECONDS.time(stage='copy'):
+                SCHEDULER.call_once('anaconda.org', 'copy', self.api.copy,
+                                    self.source, package, version, **kwargs)
+            ok = True
+        except Exception:
+            FAILURES.inc(stage='copy')
+            raise
+        finally:
+            if self.timings is not None:
+                self.timings.record(package, 'copy', time.time() - start,
+                                    ok=ok)
+
+        BUILDS_COPIED.inc(len(copied), destination=destination)
+        BYTES_COPIED.inc(sum(sizes.get(b, 0) for b in copied),
+                         destination=destination)
+
+
+class ChannelPruner(object):
+    def __init__(self, channel, input_packages, token='',
+                 keep_versions=None, drop_superseded=False, platforms=None,
+                 package_platforms=None, max_workers=DEFAULT_MAX_WORKERS,
+                 batch_size=DEFAULT_BATCH_SIZE, stream=False):
+        """
+        Plan, and optionally make, the removal of builds from a channel
+        under a retention policy, so that the channel's repodata stays
+        small.
+
+        Parameters
+        ----------
+
+        channel : ``str``
+            Name of the conda channel to prune.
+        input_packages : ``dict``
+            Packages to prune, in the same form as for `PackageCopier`. A
+            pinned version is never removed.
+        token : ``str``, optional
+            Token for conda API. Needed for the actual removal.
+        keep_versions : ``int``, optional
+            Keep only this many of the most recent versions of each package.
+            ``None``, the default, keeps every version.
+        drop_superseded : ``bool``, optional
+            If ``True``, remove builds that have been rebuilt with a higher
+            build number for the same version, platform and variant, e.g.
+            ``np111py27_0`` once there is a ``np111py27_1``.
+        platforms : list of ``str``, optional
+            Remove builds for subdirs not in this list. ``noarch`` builds
+            are never removed for this reason. ``None``, the default, keeps
+            builds for every platform.
+        package_platforms : ``dict``, optional
+            Keys are package names, values are lists of platforms that
+            replace ``platforms`` for that package.
+        max_workers : ``int``, optional
+            Largest number of removals to run at the same time.
+        batch_size : ``int``, optional
+            Number of removals to make before checking they all worked. No
+            further batches are started once one fails.
+        stream : ``bool``, optional
+            Parse package information as it arrives, as for
+            `PackageCopier`.
+
+        Attributes
+        ----------
+
+        to_remove : list of ``Removal``
+            Builds to remove. A ``basename`` of ``None`` means every build
+            of the version.
+        """
+        if keep_versions is not None and keep_versions < 1:
+            # Keeping no versions would remove every release.
+            raise ValueError('keep_versions must be at least 1, '
+                             'not {}'.format(keep_versions))
+
+        self.channel = channel
+        self.input_packages = input_packages
+        self.keep_versions = keep_versions
+        self.drop_superseded = drop_superseded
+        self.platforms = platforms
+        self.package_platforms = package_platforms or {}
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.stream = stream
+
+        self.api = get_anaconda_api(token)
+        with STAGE_SECONDS.time(stage='plan_prune'):
+            self.to_remove = self._builds_to_remove()
+
+    def _builds_to_remove(self):
+        from binstar_client.errors import NotFound
+        from conda.version import VersionOrder
+
+        removals = []
+        for p in sorted(self.input_packages):
+            pinned = self.input_packages[p]
+            try:
+                info = fetch_package(self.api, self.channel, p,
+                                     stream=self.stream)
+            except NotFound:
+                continue
+
+            files_by_version = {}
+            for f in info['files']:
+                files_by_version.setdefault(f.version, []).append(f)
+            versions = sorted(files_by_version, key=VersionOrder,
+                              reverse=True)
+
+            keep = set(versions[:self.keep_versions])
+            if pinned is not None:
+                keep.add(str(VersionOrder(pinned)))
+
+            platforms = self.package_platforms.get(p, self.platforms)
+            for version in versions:
+                files = files_by_version[version]
+                if version not in keep:
+                    removals.append(Removal(p, version, None, OLD_VERSION,
+                                            sum(f.size for f in files)))
+                    continue
+
+                superseded = (_superseded_builds(files)
+                              if self.drop_superseded else set())
+                for f in files:
+                    if (platforms is not None and f.subdir != 'noarch' and
+                            f.subdir not in platforms):
+                        reason = UNSUPPORTED_PLATFORM
+                    elif f.basename in superseded:
+                        reason = SUPERSEDED
+                    else:
+                        continue
+                    removals.append(Removal(p, version, f.basename, reason,
+                                            f.size))
+
+        return removals
+
+    def report(self):
+        """
+        Describe the planned removals, one line per removal, ending with a
+        total.
+        """
+        lines = []
+        for r in self.to_remove:
+            what = r.basename or 'all builds of {}'.format(r.version)
+            lines.append('{}: remove {} ({}, {} bytes)'.format(
+                r.package, what, r.reason, r.size))
+        lines.append('{} removals from {}, freeing {} bytes'.format(
+            len(self.to_remove), self.channel,
+            sum(r.size for r in self.to_remove)))
+        return '\n'.join(lines)
+
+    def prune(self):
+        """
+        Remove the planned builds from the channel, ``batch_size`` at a
+        time. If any removal in a batch fails the error is raised once the
+        batch has finished, and no more batches are started.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        total = len(self.to_remove)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for start in range(0, total, self.batch_size):
+                batch = self.to_remove[start:start + self.batch_size]
+                futures = [executor.submit(self._remove_one, r)
+                           for r in batch]
+                for future in futures:
+                    future.result()
+                print('Removed {} of {} from {}'.format(
+                    start + len(batch), total, self.channel))
+
+    def _remove_one(self, removal):
+        try:
+            with STAGE_SECONDS.time(stage='remove'):
+                if removal.basename is None:
+                    SCHEDULER.call_once('anaconda.org', 'remove_release',
+                                        self.api.remove_release, self.channel,
+                                        removal.package, removal.version)
+                else:
+                    SCHEDULER.call_once('anaconda.org', 'remove_dist',
+                                        self.api.remove_dist, self.channel,
+                                        removal.package, removal.version,
+                                        basename=removal.basename)
+        except Exception:
+            FAILURES.inc(stage='remove')
+            raise
+
+        BUILDS_REMOVED.inc(channel=self.channel)
+        BYTES_REMOVED.inc(removal.size, channel=self.channel)
+
+
+def _superseded_builds(files):
+    """
+    Basenames of builds, all of the same version, for which there is a
+    build with a higher build number for the same platform and variant.
+    """
+    def variant_and_number(f):
+        match = _BUILD_NUMBER.search(f.build)
+        number = int(match.group(1)) if match else 0
+        build = _BUILD_NUMBER.sub('', f.build)
+        python = _BUILD_PYTHON.search(build)
+        numpy = _BUILD_NUMPY.search(build)
+        # Whatever else is in the build string, e.g. mkl, still tells
+        # variants apart; the hash does not.
+        rest = build
+        for pattern in [_BUILD_PYTHON, _BUILD_NUMPY, _BUILD_HASH]:
+            rest = pattern.sub('', rest)
+        variant = (f.subdir, python and python.group(1),
+                   numpy and numpy.group(1), rest)
+        return variant, number
+
+    latest = {}
+    for f in files:
+        variant, number = variant_and_number(f)
+        latest[variant] = max(latest.get(variant, number), number)
+
+    superseded = set()
+    for f in files:
+        variant, number = variant_and_number(f)
+        if number < latest[variant]:
+            superseded.add(f.basename)
+    return superseded
+
+
+def build_parser():
+    """
+    Command line parser for ``copy_packages``.
+    """
     parser = ArgumentParser('Simple script for copying packages '
                             'from one conda owner to another')
     parser.add_argument('packages_yaml',
@@ -160,13 +636,104 @@ def main(arguments=None):
                         help=('anaconda.org API token. May set '
                               'environmental variable BINSTAR_TOKEN '
                               'instead.'))
-    parser.add_argument('destination_channel',
-                        help=('Destination conda channel owner.'))
-    if arguments is None:
-        args = parser.parse_args()
-    else:
-        args = parser.parse_args(arguments)
+    parser.add_argument('--max-workers', type=int,
+                        default=DEFAULT_MAX_WORKERS,
+                        help=('Largest number of copies to run at once. '
+                              'Default: {}'.format(DEFAULT_MAX_WORKERS)))
+    parser.add_argument('--platforms', nargs='+', default=None,
+                        help=('Only copy builds for these platforms, e.g. '
+                              'linux-64 osx-64. noarch builds are always '
+                              'copied. Default is all platforms.'))
+    parser.add_argument('--pythons', nargs='+', default=None,
+                        help=('Only copy builds for these python versions, '
+                              'written as in a build string, e.g. 27 36. '
+                              'Default is all pythons.'))
+    parser.add_argument('--numpy', nargs='+', default=None,
+                        help=('Only copy builds for these numpy versions, '
+                              'written as in a build string, e.g. 111 112. '
+                              'Default is all numpy versions.'))
+    parser.add_argument('--requirements', default=None,
+                        help=('requirements.yml describing the packages. '
+                              'Only builds for the platforms and pythons '
+                              'each package is built for are copied.'))
+    parser.add_argument('--stream-metadata', action='store_true',
+                        default=False, dest='stream_metadata',
+                        help=('Parse package information from anaconda.org '
+                              'as it arrives, keeping memory use flat when '
+                              'planning many large packages.'))
+    parser.add_argument('--metrics-file', default=None,
+                        help=('Write metrics for the run to this file, in '
+                              'the Prometheus text format, when the run '
+                              'ends.'))
+    parser.add_argument('--timings-db', default=default_timings_path(),
+                        help=('Database of how long each package took to '
+                              'copy in past runs, used to start the slowest '
+                              'first and estimate how long copying will '
+                              "take; '' to not use one. Default: "
+                              "'{}'".format(default_timings_path())))
+    parser.add_argument('--snapshot-dir', default=default_snapshot_dir(),
+                        help=('Folder of snapshots of package information, '
+                              'so that only packages that have changed '
+                              "since the last run are downloaded; '' to "
+                              "not use one. Default: "
+                              "'{}'".format(default_snapshot_dir())))
+    parser.add_argument('destination_channel', nargs='+',
+                        help=('Destination conda channel owner. Give more '
+                              'than one to copy to several channels.'))
+    return parser
+
+
+def _token(token, require_token=True):
+    """
+    The anaconda.org API token from the command line or, failing that, the
+    environment.
+    """
+    # No token on command line, try the environment...
+    if not token:
+        token = os.getenv('BINSTAR_TOKEN')
 
+    # Still no token, so raise an error
+    if not token:
+        if require_token:
+            raise RuntimeError('Set an anaconda.org API token before running')
+        token = ''
+
+    return token
+
+
+def _requirements_filters(requirements):
+    """
+    Per-package filters from the platforms and pythons each package in a
+    requirements.yml is built for.
+    """
+    from .extrude_recipes import get_package_versions
+
+    package_filters = {}
+    for p in get_package_versions(requirements):
+        package_filters[p.conda_name] = {
+            'platforms': p.build_platforms,
+            'pythons': p.build_pythons,
+        }
+    return package_filters
+
+
+def copier_from_arguments(args, require_token=True, timings=None):
+    """
+    Construct a `PackageCopier` from parsed command line arguments.
+
+    Parameters
+    ----------
+
+    args : ``argparse.Namespace``
+        Arguments parsed by the parser from `build_parser`.
+    require_token : ``bool``, optional
+        If ``True``, raise an error if no API token is given either on the
+        command line or in the environment. Planning a copy does not need a
+        token; doing the copy does.
+    timings : `extruder.timings.TimingStore`, optional
+        Store opened, e.g. with `extruder.timings.timings_at`, from
+        ``args.timings_db``. The caller closes it.
+    """
     source = args.source
     dest = args.destination_channel
     package_file = args.packages_yaml
@@ -175,16 +742,128 @@ def main(arguments=None):
     with open(package_file) as f:
         packages = yaml.load(f)
 
-    # No token on command line, try the environment...
-    if not token:
-        token = os.getenv('BINSTAR_TOKEN')
+    token = _token(token, require_token)
 
-    # Still no token, so raise an error
-    if not token:
-        raise RuntimeError('Set an anaconda.org API token before running')
+    package_filters = {}
+    if args.requirements:
+        package_filters = _requirements_filters(args.requirements)
+
+    return PackageCopier(source, dest, packages, token=token,
+                         max_workers=args.max_workers,
+                         platforms=args.platforms,
+                         pythons=args.pythons,
+                         numpy=args.numpy,
+                         package_filters=package_filters,
+                         stream=args.stream_metadata,
+                         timings=timings,
+                         snapshot_dir=args.snapshot_dir)
+
+
+def main(arguments=None):
+    args = build_parser().parse_args(arguments)
+
+    try:
+        with timings_at(args.timings_db) as timings:
+            pc = copier_from_arguments(args, timings=timings)
+            pc.copy_packages()
+    finally:
+        if args.metrics_file:
+            REGISTRY.write_textfile(args.metrics_file)
+
+
+def _at_least_one(value):
+    """
+    argparse type for a whole number of at least one.
+    """
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError('must be at least 1, not {}'.format(value))
+    return number
+
+
+def build_prune_parser():
+    """
+    Command line parser for ``prune_packages``.
+    """
+    parser = ArgumentParser('Remove old, superseded or unsupported builds '
+                            'from a conda channel')
+    parser.add_argument('packages_yaml',
+                        help=('Packages to prune, in the same form as for '
+                              'copy_packages. A pinned version is never '
+                              'removed.'))
+    parser.add_argument('channel',
+                        help='Conda channel owner to prune.')
+    parser.add_argument('--token', default='',
+                        help=('anaconda.org API token. May set '
+                              'environmental variable BINSTAR_TOKEN '
+                              'instead.'))
+    parser.add_argument('--keep-versions', type=_at_least_one, default=None,
+                        help=('Keep only this many of the most recent '
+                              'versions of each package. Default is to '
+                              'keep every version.'))
+    parser.add_argument('--drop-superseded', action='store_true',
+                        default=False,
+                        help=('Remove builds replaced by a build with a '
+                              'higher build number.'))
+    parser.add_argument('--platforms', nargs='+', default=None,
+                        help=('Remove builds for any other platform. '
+                              'noarch builds are always kept. Default is '
+                              'to keep builds for all platforms.'))
+    parser.add_argument('--requirements', default=None,
+                        help=('requirements.yml describing the packages. '
+                              'Builds for platforms a package is not built '
+                              'for are removed.'))
+    parser.add_argument('--max-workers', type=int,
+                        default=DEFAULT_MAX_WORKERS,
+                        help=('Largest number of removals to run at once. '
+                              'Default: {}'.format(DEFAULT_MAX_WORKERS)))
+    parser.add_argument('--batch-size', type=_at_least_one,
+                        default=DEFAULT_BATCH_SIZE,
+                        help=('Number of removals to make before checking '
+                              'they all worked. Default: '
+                              '{}'.format(DEFAULT_BATCH_SIZE)))
+    parser.add_argument('--dry-run', action='store_true', default=False,
+                        help='Only report what would be removed.')
+    parser.add_argument('--stream-metadata', action='store_true',
+                        default=False, dest='stream_metadata',
+                        help=('Parse package information from anaconda.org '
+                              'as it arrives.'))
+    parser.add_argument('--metrics-file', default=None,
+                        help=('Write metrics for the run to this file, in '
+                              'the Prometheus text format, when the run '
+                              'ends.'))
+    return parser
+
+
+def prune_main(arguments=None):
+    args = build_prune_parser().parse_args(arguments)
+
+    try:
+        with open(args.packages_yaml) as f:
+            packages = yaml.load(f)
+
+        package_platforms = {}
+        if args.requirements:
+            for name, filters in \
+                    _requirements_filters(args.requirements).items():
+                package_platforms[name] = filters['platforms']
 
-    pc = PackageCopier(source, dest, packages, token=token)
-    pc.copy_packages()
+        pruner = ChannelPruner(args.channel, packages,
+                               token=_token(args.token,
+                                            require_token=not args.dry_run),
+                               keep_versions=args.keep_versions,
+                               drop_superseded=args.drop_superseded,
+                               platforms=args.platforms,
+                               package_platforms=package_platforms,
+                               max_workers=args.max_workers,
+                               batch_size=args.batch_size,
+                               stream=args.stream_metadata)
+        print(pruner.report())
+        if not args.dry_run:
+            pruner.prune()
+    finally:
+        if args.metrics_file:
+            REGISTRY.write_textfile(args.metrics_file)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,359 @@
+from __future__ import (division, print_function, absolute_import)
+
+from argparse import ArgumentParser, REMAINDER
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import traceback
+
+from ruamel import yaml
+from six.moves import socketserver
+
+# The daemon keeps conda-build, the anaconda.org and PyPI clients and the
+# jinja2 environments loaded between jobs. Jobs are sent over a Unix socket
+# as a single line of JSON; the daemon answers with one line of JSON per
+# line of output from the job, followed by a final "done" or "error" line.
+#
+# Jobs are run one at a time, in the daemon's main thread, so that the
+# existing code, which prints progress and works relative to the current
+# directory, can be used unchanged.
+
+JOBS = ['render', 'plan_copy', 'copy', 'shutdown']
+
+# Seconds a client has to send its job once connected. Jobs are run one at a
+# time, so a client that never sends one would otherwise block the daemon.
+REQUEST_TIMEOUT = 10
+
+
+def default_socket_path():
+    """
+    Path of the socket used when none is given on the command line.
+    """
+    return os.path.join(tempfile.gettempdir(),
+                        'extruder-{}.sock'.format(os.getuid()))
+
+
+def _send(wfile, **message):
+    wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+    wfile.flush()
+
+
+class _SocketOutput(object):
+    """
+    File-like object that sends each complete line written to it to the
+    client as an ``output`` message.
+    """
+    def __init__(self, wfile, stream):
+        self._wfile = wfile
+        self._stream = stream
+        self._buffer = ''
+
+    def write(self, text):
+        self._buffer += text
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            _send(self._wfile, event='output', stream=self._stream, text=line)
+
+    def flush(self):
+        # Partial lines are held until they are complete or the job ends.
+        pass
+
+    # Some libraries look at stdout before writing to it.
+    encoding = 'utf-8'
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        raise io.UnsupportedOperation('fileno')
+
+    def close(self):
+        if self._buffer:
+            _send(self._wfile, event='output', stream=self._stream,
+                  text=self._buffer)
+            self._buffer = ''
+
+
+def _render(job):
+    from . import extrude_recipes
+
+    args = extrude_recipes.build_parser().parse_args(job['arguments'])
+    extrude_recipes.main(args)
+
+
+def _copy_job(job, do_copy):
+    from . import copy_packages
+    from .timings import timings_at
+
+    args = copy_packages.build_parser().parse_args(job['arguments'])
+    if not args.token:
+        args.token = job.get('token') or ''
+    # Closed after each job so the daemon does not keep one open per run.
+    with timings_at(args.timings_db) as timings:
+        pc = copy_packages.copier_from_arguments(args,
+                                                 require_token=do_copy,
+                                                 timings=timings)
+        if do_copy:
+            pc.copy_packages()
+    return pc.plans
+
+
+def _plan_copy(job):
+    return _copy_job(job, do_copy=False)
+
+
+def _copy(job):
+    return _copy_job(job, do_copy=True)
+
+
+_RUNNERS = {
+    'render': _render,
+    'plan_copy': _plan_copy,
+    'copy': _copy,
+}
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """
+    Run one job sent by a client, streaming its output back.
+    """
+    def handle(self):
+        self.request.settimeout(REQUEST_TIMEOUT)
+        try:
+            line = self.rfile.readline()
+        except socket.timeout:
+            _send(self.wfile, event='error',
+                  message='No job received within {} '
+                          'seconds'.format(REQUEST_TIMEOUT))
+            return
+        # The job itself may take as long as it needs.
+        self.request.settimeout(None)
+        if not line:
+            # A client checking whether the daemon is running.
+            return
+        try:
+            job = json.loads(line.decode('utf-8'))
+            name = job['job']
+        except (ValueError, KeyError, TypeError):
+            _send(self.wfile, event='error', message='Malformed job request')
+            return
+
+        if name == 'shutdown':
+            self.server.shutdown_requested = True
+            _send(self.wfile, event='done', result=None)
+            return
+
+        try:
+            runner = _RUNNERS[name]
+        except KeyError:
+            _send(self.wfile, event='error',
+                  message='Unknown job {}'.format(name))
+            return
+
+        out = _SocketOutput(self.wfile, 'stdout')
+        err = _SocketOutput(self.wfile, 'stderr')
+        original_stdout, original_stderr = sys.stdout, sys.stderr
+        original_cwd = os.getcwd()
+        sys.stdout, sys.stderr = out, err
+        try:
+            os.chdir(job.get('cwd', original_cwd))
+            result = runner(job)
+        except SystemExit as e:
+            # argparse exits after printing help or a usage error.
+            out.close()
+            err.close()
+            if e.code:
+                _send(self.wfile, event='error',
+                      message='Job exited with status {}'.format(e.code))
+            else:
+                _send(self.wfile, event='done', result=None)
+        except Exception as e:
+            out.close()
+            err.close()
+            _send(self.wfile, event='error', message=str(e),
+                  traceback=traceback.format_exc())
+        else:
+            out.close()
+            err.close()
+            _send(self.wfile, event='done', result=result)
+        finally:
+            sys.stdout, sys.stderr = original_stdout, original_stderr
+            os.chdir(original_cwd)
+
+
+class JobServer(socketserver.UnixStreamServer):
+    shutdown_requested = False
+
+
+def _warm_up():
+    """
+    Import everything jobs will need and create the anonymous anaconda.org
+    client so that the first job does not pay for it.
+    """
+    import conda_build.api  # noqa
+    import conda.version  # noqa
+    import jinja2  # noqa
+    import binstar_client.errors  # noqa
+
+    from .clients import get_anaconda_api, get_pypi_client
+
+    get_anaconda_api('')
+    get_pypi_client()
+
+
+def _daemon_is_running(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        return False
+    else:
+        return True
+    finally:
+        sock.close()
+
+
+def serve(socket_path, metrics_port=None):
+    """
+    Run the daemon, listening on ``socket_path``, until it is sent a
+    ``shutdown`` job or interrupted.
+
+    If ``metrics_port`` is given, metrics for all of the jobs run are served
+    over HTTP on that port of localhost.
+    """
+    if os.path.exists(socket_path):
+        if _daemon_is_running(socket_path):
+            raise RuntimeError('An extruder daemon is already listening '
+                               'on {}'.format(socket_path))
+        # Left over from a daemon that did not shut down cleanly.
+        os.remove(socket_path)
+
+    _warm_up()
+
+    # Only the user running the daemon should be able to submit jobs.
+    old_umask = os.umask(0o077)
+    try:
+        server = JobServer(socket_path, JobHandler)
+    finally:
+        os.umask(old_umask)
+
+    print('extruder daemon listening on {}'.format(socket_path))
+
+    metrics_server = None
+    if metrics_port is not None:
+        from .metrics import REGISTRY
+
+        metrics_server = REGISTRY.serve(metrics_port)
+        print('Serving metrics on port {}'.format(metrics_port))
+
+    try:
+        while not server.shutdown_requested:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+
+def submit(job, socket_path=None, stdout=None, stderr=None):
+    """
+    Send a job to the daemon, writing its output to ``stdout`` and
+    ``stderr`` as it arrives.
+
+    Parameters
+    ----------
+
+    job : dict
+        The job. Must contain ``job``, one of ``JOBS``; other keys depend on
+        the job.
+    socket_path : str, optional
+        Path to the daemon's socket. Defaults to `default_socket_path`.
+    stdout, stderr : file-like, optional
+        Where to write the job's output. Default to ``sys.stdout`` and
+        ``sys.stderr``.
+
+    Returns
+    -------
+
+    dict
+        The final message from the daemon, whose ``event`` is either
+        ``'done'`` or ``'error'``.
+    """
+    socket_path = socket_path or default_socket_path()
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    try:
+        sock.sendall((json.dumps(job) + '\n').encode('utf-8'))
+        for raw in sock.makefile('rb'):
+            message = json.loads(raw.decode('utf-8'))
+            if message['event'] != 'output':
+                return message
+            stream = stderr if message['stream'] == 'stderr' else stdout
+            stream.write(message['text'] + '\n')
+            stream.flush()
+    finally:
+        sock.close()
+
+    raise RuntimeError('The extruder daemon closed the connection before '
+                       'the job finished')
+
+
+def main(arguments=None):
+    parser = ArgumentParser('Run a long-lived extruder process that keeps '
+                            'conda-build and the API clients loaded and runs '
+                            'jobs sent by extruder_client.')
+    parser.add_argument('--socket', default=default_socket_path(),
+                        help=('Path of the Unix socket to listen on. '
+                              'Default: {}'.format(default_socket_path())))
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help=('Serve metrics, in the Prometheus text '
+                              'format, on this port of localhost.'))
+    args = parser.parse_args(arguments)
+
+    serve(args.socket, metrics_port=args.metrics_port)
+
+
+def client_main(arguments=None):
+    parser = ArgumentParser('Submit a job to a running extruder daemon and '
+                            'stream its output.')
+    parser.add_argument('--socket', default=default_socket_path(),
+                        help=('Path of the daemon\'s Unix socket. '
+                              'Default: {}'.format(default_socket_path())))
+    parser.add_argument('job', choices=JOBS,
+                        help=('render runs extrude_recipes; plan_copy and '
+                              'copy run copy_packages, plan_copy only '
+                              'reporting what would be copied.'))
+    parser.add_argument('arguments', nargs=REMAINDER,
+                        help=('Arguments for the job, the same as for '
+                              'extrude_recipes or copy_packages.'))
+    args = parser.parse_args(arguments)
+
+    job = {
+        'job': args.job,
+        'arguments': args.arguments,
+        'cwd': os.getcwd(),
+        'token': os.getenv('BINSTAR_TOKEN', ''),
+    }
+
+    result = submit(job, socket_path=args.socket)
+
+    if result['event'] == 'error':
+        print(result.get('traceback') or result['message'], file=sys.stderr)
+        sys.exit(1)
+
+    if result['result']:
+        yaml.safe_dump(result['result'], sys.stdout,
+                       default_flow_style=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,33 +2,54 @@ from __future__ import (division, print_function, absolute_import)
 
 
 from argparse import ArgumentParser
+from array import array
+import glob
 import os
 import re
+import shutil
 
 from ruamel import yaml
 
-from conda import config
-from conda_build.api import skeletonize
-from binstar_client.utils import get_server_api
-from binstar_client.errors import NotFound
+from .clients import get_anaconda_api, get_pypi_client, pypi_release
+# PYPI_XMLRPC used to be defined here; kept importable from this module for
+# code that still does so.
+from .clients import PYPI_XMLRPC  # noqa: F401
+from .fast_recipe import write_fast_recipe
+from .metrics import REGISTRY, FAILURES, RECIPES_WRITTEN, STAGE_SECONDS
+from .scheduler import SCHEDULER
+from .snapshots import default_snapshot_dir, open_snapshots
+from .skeleton_runner import (run_skeletons, DEFAULT_MEMORY_MB,
+                              DEFAULT_TIMEOUT)
+from .timings import (default_timings_path, longest_first, timings_at,
+                      print_estimate)
+
+# conda, conda-build, anaconda-client and jinja2 are imported inside the
+# functions that use them so that starting the command line tool (e.g. for
+# --help) does not pay for importing them.
 
-from six.moves import xmlrpc_client as xmlrpclib
-
-from jinja2 import Environment, FileSystemLoader
-from jinja2.exceptions import TemplateNotFound
-
-PYPI_XMLRPC = 'https://pypi.python.org/pypi'
 TEMPLATE_FOLDER = 'recipe_templates'
 RECIPE_FOLDER = 'recipes'
 ALL_PLATFORMS = ['osx-64', 'linux-64', 'linux-32', 'win-32', 'win-64']
+DEFAULT_PYTHONS = ['27', '35']
 
 CONDA_FORGE_FEEDSTOCK_TARBALL = ('https://github.com/conda-forge/{}-feedstock'
                                  '/archive/master.tar.gz')
 
+# Patterns for reading the name and version out of a feedstock's meta.yaml,
+# which is a jinja2 template, without rendering it.
+_JINJA_SET = re.compile(r'{%\s*set\s+(\w+)\s*=\s*[\'"]([^\'"]*)[\'"]\s*%}')
+_JINJA_VARIABLE = re.compile(r'{{\s*(\w+)\s*(\|\s*lower\s*)?}}')
+_PACKAGE_SECTION = re.compile(r'^package:[ \t]*\n((?:[ \t]+.*\n?|[ \t]*\n)+)',
+                              re.MULTILINE)
+
+# One jinja2 environment per template folder.
+_jinja_environments = {}
+
 
 def get_pypi_info(name):
-    client = xmlrpclib.ServerProxy(PYPI_XMLRPC, allow_none=True)
-    pypi_stable = client.package_releases(name)
+    client = get_pypi_client()
+    pypi_stable = SCHEDULER.call('pypi', 'package_releases',
+                                 client.package_releases, name)
     try:
         return pypi_stable[0]
     except IndexError:
@@ -50,9 +71,6 @@ class Package(object):
         recent version visible on PyPI should be used.
     """
 
-    # The class should only need one client for communicating with PyPI
-    client = xmlrpclib.ServerProxy(PYPI_XMLRPC, allow_none=True)
-
     def __init__(self, pypi_name, version=None,
                  numpy_compiled_extensions=False,
                  setup_options=None,
@@ -62,6 +80,7 @@ class Package(object):
                  include_extras=False):
         self._pypi_name = pypi_name
         self.required_version = version
+        self._version = None
         self._build = False
         self._url = None
         self._md5 = None
@@ -75,6 +94,13 @@ class Package(object):
         self._excluded_platforms = excluded_platforms or []
         self._include_extras = include_extras
 
+    @property
+    def client(self):
+        """
+        XML-RPC client for PyPI, shared by all instances in a thread.
+        """
+        return get_pypi_client()
+
     @property
     def pypi_name(self):
         """
@@ -196,7 +222,7 @@ class Package(object):
         try:
             pythons = self.extra_meta['extra']['pythons']
         except KeyError:
-            pythons = ["27", "35"]
+            pythons = DEFAULT_PYTHONS
 
         # Make sure version is always a string so it can be compared
         # to CONDA_PY later.
@@ -208,6 +234,8 @@ class Package(object):
         """
         The 'extra' metadata, for now read in from meta.yaml.
         """
+        from jinja2.exceptions import TemplateNotFound
+
         if self._extra_meta is not None:
             return self._extra_meta
 
@@ -222,17 +250,31 @@ class Package(object):
 
         return self._extra_meta
 
+    @property
+    def version(self):
+        """
+        Version to build: the required version or, if there is none, the
+        most recent version on PyPI.
+        """
+        if self.required_version:
+            return self.required_version
+        if self._version is None:
+            self._version = get_pypi_info(self.pypi_name)
+        return self._version
+
+    def release_files(self):
+        """
+        Files on PyPI for the version to build, as returned by PyPI's
+        ``release_urls``.
+        """
+        return pypi_release('release_urls', self.pypi_name, self.version)
+
     def _retrieve_package_metadata(self):
         """
         Get URL and md5 checksum from PyPI for either the specified version
         or the most recent version.
         """
-        if not self.required_version:
-            version = get_pypi_info(self.pypi_name)
-        else:
-            version = self.required_version
-
-        urls = self.client.release_urls(self.pypi_name, version)
+        urls = self.release_files()
         try:
             # Many packages now have wheels, need to iterate over download
             # URLs to get the source distribution.
@@ -260,9 +302,34 @@ class Package(object):
         True if the current build platform is supported by the package, False
         otherwise.
         """
+        from conda import config
+
         return config.subdir in self.build_platforms
 
 
+def _package_arguments(requirement):
+    """
+    Arguments for `Package` from one entry of ``requirements.yml``.
+
+    Returns
+    -------
+
+    tuple
+        The PyPI name and a dictionary of keyword arguments.
+    """
+    # TODO: Get supported platforms from requirements,
+    #       not from recipe template.
+    return requirement['name'], dict(
+        version=requirement.get('version', None),
+        setup_options=requirement.get('setup_options', None),
+        numpy_compiled_extensions=requirement.get('numpy_compiled_extensions',
+                                                  False),
+        python_requirements=requirement.get('python', []),
+        numpy_requirements=requirement.get('numpy_build_restrictions', []),
+        excluded_platforms=requirement.get('excluded_platforms', []),
+        include_extras=requirement.get('include_extras', False))
+
+
 def get_package_versions(requirements_path):
     """
     Read and parse list of packages.
@@ -284,28 +351,268 @@ def get_package_versions(requirements_path):
 
     packages = []
     for p in package_list:
-        helpers = p.get('setup_options', None)
-        numpy_extensions = p.get('numpy_compiled_extensions', False)
-        python_requirements = p.get('python', [])
-        numpy_requirements = p.get('numpy_build_restrictions', [])
-        version = p.get('version', None)
-        excluded_platforms = p.get('excluded_platforms', [])
-        include_extras = p.get('include_extras', False)
-
-        # TODO: Get supported platforms from requirements,
-        #       not from recipe template.
-        packages.append(Package(p['name'],
-                                version=version,
-                                setup_options=helpers,
-                                numpy_compiled_extensions=numpy_extensions,
-                                python_requirements=python_requirements,
-                                numpy_requirements=numpy_requirements,
-                                excluded_platforms=excluded_platforms,
-                                include_extras=include_extras))
+        name, kwargs = _package_arguments(p)
+        packages.append(Package(name, **kwargs))
 
     return packages
 
 
+# Bits in the flags column of a PackageSet.
+_NUMPY_EXTENSIONS = 1
+_INCLUDE_EXTRAS = 2
+_DEV = 4
+
+# Arguments of Package that are usually left at their defaults, which a
+# PackageSet only stores for the packages that set them.
+_SPARSE_ARGUMENTS = ['setup_options', 'python_requirements',
+                     'numpy_requirements', 'excluded_platforms']
+
+
+_PACKAGE_DEFAULTS = dict(version=None,
+                         numpy_compiled_extensions=False,
+                         include_extras=False,
+                         setup_options=None,
+                         python_requirements=None,
+                         numpy_requirements=None,
+                         excluded_platforms=None)
+
+
+class _PackageColumns(object):
+    """
+    Storage shared by a `PackageSet` and the subsets made from it.
+
+    Platforms and pythons are stored as bitmasks over the lists
+    ``platform_names`` and ``python_names``.
+    """
+    __slots__ = ('pypi_names', 'versions', 'platforms', 'pythons', 'flags',
+                 'sparse', 'platform_names', 'python_names', 'index')
+
+    def __init__(self):
+        self.pypi_names = []
+        self.versions = []
+        self.platforms = array('L')
+        self.pythons = array('L')
+        self.flags = array('B')
+        # Row number -> dict of the _SPARSE_ARGUMENTS that are set.
+        self.sparse = {}
+        self.platform_names = list(ALL_PLATFORMS)
+        self.python_names = []
+        # Conda name -> row number.
+        self.index = {}
+
+    @staticmethod
+    def _mask(values, names):
+        mask = 0
+        for value in values:
+            if value not in names:
+                names.append(value)
+            mask |= 1 << names.index(value)
+        return mask
+
+    @staticmethod
+    def _unmask(mask, names):
+        return [name for i, name in enumerate(names) if mask & (1 << i)]
+
+    def append(self, name, kwargs, platforms, pythons):
+        row = len(self.pypi_names)
+        version = kwargs['version']
+        if version is not None:
+            version = str(version).strip()
+        self.pypi_names.append(name)
+        self.versions.append(version)
+        self.platforms.append(self._mask(platforms, self.platform_names))
+        self.pythons.append(self._mask(pythons, self.python_names))
+        flags = 0
+        if kwargs['numpy_compiled_extensions']:
+            flags |= _NUMPY_EXTENSIONS
+        if kwargs['include_extras']:
+            flags |= _INCLUDE_EXTRAS
+        if version and re.search('a|b|rc|dev', version):
+            flags |= _DEV
+        self.flags.append(flags)
+        sparse = dict((k, kwargs[k]) for k in _SPARSE_ARGUMENTS if kwargs[k])
+        if sparse:
+            self.sparse[row] = sparse
+        self.index[name.lower()] = row
+
+    def package(self, row):
+        sparse = self.sparse.get(row, {})
+        flags = self.flags[row]
+        package = Package(
+            self.pypi_names[row],
+            version=self.versions[row],
+            numpy_compiled_extensions=bool(flags & _NUMPY_EXTENSIONS),
+            include_extras=bool(flags & _INCLUDE_EXTRAS),
+            setup_options=sparse.get('setup_options'),
+            python_requirements=sparse.get('python_requirements', []),
+            numpy_requirements=sparse.get('numpy_requirements', []),
+            excluded_platforms=sparse.get('excluded_platforms', []))
+        # Already worked out when the row was added, so save the Package
+        # from looking for a recipe template again.
+        package._build_platforms = self._unmask(self.platforms[row],
+                                                self.platform_names)
+        package._build_pythons = self._unmask(self.pythons[row],
+                                              self.python_names)
+        return package
+
+
+class PackageSet(object):
+    """
+    Compact, column-oriented collection of the packages in a
+    ``requirements.yml``, for requirements with very many entries.
+
+    Filtering and partitioning return new ``PackageSet`` objects that share
+    the columns of the original; `Package` objects are only made when the
+    set is iterated over or a package is looked up.
+    """
+    __slots__ = ('_columns', '_rows', '_members')
+
+    def __init__(self, columns=None, rows=None):
+        self._columns = columns if columns is not None else _PackageColumns()
+        if rows is None:
+            rows = array('L', range(len(self._columns.pypi_names)))
+        self._rows = rows
+        # Set of rows, made the first time a subset needs it.
+        self._members = None
+
+    @classmethod
+    def from_requirements(cls, requirements_path):
+        """
+        Read ``requirements.yml`` into a ``PackageSet``.
+
+        Platforms and pythons come from the recipe template, as they do for
+        `Package`, only for packages that have one in ``TEMPLATE_FOLDER``.
+        """
+        with open(requirements_path, 'rt') as f:
+            package_list = yaml.safe_load(f)
+
+        package_set = cls()
+        for requirement in package_list:
+            name, kwargs = _package_arguments(requirement)
+            package_set.add(name, **kwargs)
+        return package_set
+
+    def add(self, pypi_name, **kwargs):
+        """
+        Add a package; the arguments are the same as for `Package`.
+        """
+        if len(self._rows) != len(self._columns.pypi_names):
+            raise ValueError('Packages can only be added to a PackageSet, '
+                             'not to a subset of one.')
+        arguments = dict(_PACKAGE_DEFAULTS)
+        arguments.update(kwargs)
+        conda_name = pypi_name.lower()
+        if os.path.isdir(os.path.join(TEMPLATE_FOLDER, conda_name)):
+            package = Package(pypi_name, **kwargs)
+            platforms = package.build_platforms
+            pythons = package.build_pythons
+        else:
+            excluded = arguments['excluded_platforms'] or []
+            platforms = [p for p in ALL_PLATFORMS if p not in excluded]
+            pythons = DEFAULT_PYTHONS
+        self._columns.append(pypi_name, arguments, platforms, pythons)
+        self._rows.append(len(self._columns.pypi_names) - 1)
+        self._members = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        for row in self._rows:
+            yield self._columns.package(row)
+
+    def __contains__(self, conda_name):
+        row = self._columns.index.get(conda_name)
+        if row is None:
+            return False
+        if len(self._rows) == len(self._columns.pypi_names):
+            return True
+        if self._members is None:
+            self._members = set(self._rows)
+        return row in self._members
+
+    def __getitem__(self, conda_name):
+        """
+        The `Package` whose conda name is ``conda_name``.
+        """
+        if conda_name not in self:
+            raise KeyError(conda_name)
+        return self._columns.package(self._columns.index[conda_name])
+
+    @property
+    def conda_names(self):
+        return [self._columns.pypi_names[row].lower() for row in self._rows]
+
+    def _subset(self, keep):
+        return PackageSet(self._columns,
+                          array('L', (row for row in self._rows
+                                      if keep(row))))
+
+    def for_subdir(self, subdir):
+        """
+        Packages that can be built on platform ``subdir``, e.g.
+        ``'linux-64'``.
+        """
+        try:
+            bit = 1 << self._columns.platform_names.index(subdir)
+        except ValueError:
+            return PackageSet(self._columns, array('L'))
+        platforms = self._columns.platforms
+        return self._subset(lambda row: platforms[row] & bit)
+
+    def for_python(self, python):
+        """
+        Packages that are built for ``python``, written as in
+        `Package.build_pythons`, e.g. ``'35'``.
+        """
+        try:
+            bit = 1 << self._columns.python_names.index(str(python))
+        except ValueError:
+            return PackageSet(self._columns, array('L'))
+        pythons = self._columns.pythons
+        return self._subset(lambda row: pythons[row] & bit)
+
+    def dev(self, is_dev=True):
+        """
+        Packages whose version is (or, if ``is_dev`` is ``False``, is not)
+        a development or pre-release version.
+        """
+        flags = self._columns.flags
+        return self._subset(lambda row: bool(flags[row] & _DEV) == is_dev)
+
+    def partition(self, conda_names):
+        """
+        Split into the packages whose conda names are in ``conda_names`` and
+        those whose names are not.
+        """
+        conda_names = set(conda_names)
+        index = self._columns.index
+        selected = set(index[n] for n in conda_names if n in index)
+        return (self._subset(lambda row: row in selected),
+                self._subset(lambda row: row not in selected))
+
+
+def get_jinja_environment(folder):
+    """
+    Return the jinja2 environment for templates in ``folder``, reusing the
+    one created on an earlier call for the same folder.
+
+    The environment checks template modification times, so edits to the
+    templates are picked up even when the environment is reused.
+    """
+    from jinja2 import Environment, FileSystemLoader
+
+    full_template_path = os.path.abspath(folder)
+    try:
+        return _jinja_environments[full_template_path]
+    except KeyError:
+        pass
+
+    jinja_env = Environment(loader=FileSystemLoader(full_template_path))
+    _jinja_environments[full_template_path] = jinja_env
+    return jinja_env
+
+
 def render_template(package, template, folder=TEMPLATE_FOLDER):
     """
     Render recipe components from jinja2 templates.
@@ -320,30 +627,25 @@ def render_template(package, template, folder=TEMPLATE_FOLDER):
     folder : str
         Path to folder containing template.
     """
-    full_template_path = os.path.abspath(folder)
-    jinja_env = Environment(loader=FileSystemLoader(full_template_path))
+    jinja_env = get_jinja_environment(folder)
     tpl = jinja_env.get_template('/'.join([package.conda_name, template]))
     rendered = tpl.render(version=package.required_version, md5=package.md5)
     return rendered
 
 
-def generate_skeleton(package, path):
+def skeleton_arguments(package, path):
     """
-    Use conda skeleton pypi to generate a recipe for a package and
-    save it to path.
+    Arguments for ``conda_build.api.skeletonize`` to generate a recipe for a
+    package and save it to path.
 
-    Parameters
-    ----------
-
-    package: Package
-        The package for which a recipe is to be generated.
+    Returns
+    -------
 
-    path: str
-        Path to which the recipe should be written.
+    dict
+        Keys ``args``, the positional arguments, and ``kwargs``, the keyword
+        arguments. Both can be serialized as JSON so that the recipe can be
+        generated in another process.
     """
-
-    additional_arguments = ['--version', str(package.required_version),
-                            '--output-dir', path]
     additional_arguments = {}
     if package.include_extras:
         additional_arguments['all_extras'] = True
@@ -360,20 +662,47 @@ def generate_skeleton(package, path):
     if package.numpy_compiled_extensions:
         additional_arguments['pin_numpy'] = True
 
-    skeletonize(package.pypi_name, 'pypi',
-                output_dir=path,
-                version=str(package.required_version),
-                **additional_arguments)
+    additional_arguments['output_dir'] = path
+    additional_arguments['version'] = str(package.required_version)
+    return {'args': [package.pypi_name, 'pypi'],
+            'kwargs': additional_arguments}
 
 
-def get_conda_forge_version(package):
+def generate_skeleton(package, path):
     """
-    Check whether we can copy version we want from conda-forge.
+    Use conda skeleton pypi to generate a recipe for a package and
+    save it to path.
+
+    Parameters
+    ----------
+
+    package: Package
+        The package for which a recipe is to be generated.
+
+    path: str
+        Path to which the recipe should be written.
+    """
+    from conda_build.api import skeletonize
+
+    arguments = skeleton_arguments(package, path)
+    skeletonize(*arguments['args'], **arguments['kwargs'])
+
+
+def get_conda_forge_version(package, snapshots=None):
     """
-    api = get_server_api('')
+    Check whether we can copy version we want from conda-forge.
 
+    If ``snapshots``, an `extruder.snapshots.ChannelSnapshots`, is given,
+    package information is only downloaded if it has changed since it was
+    last looked at.
+    """
     # A NotFound error will be raised if the package is not found.
-    conda_forge = api.package('conda-forge', package.conda_name)
+    if snapshots is not None:
+        conda_forge = snapshots.package('conda-forge', package.conda_name)
+    else:
+        api = get_anaconda_api('')
+        conda_forge = SCHEDULER.call('anaconda.org', 'package', api.package,
+                                     'conda-forge', package.conda_name)
 
     if package.required_version:
         return package.required_version in conda_forge["versions"]
@@ -382,6 +711,100 @@ def get_conda_forge_version(package):
         return True
 
 
+def _recipe_name_and_version(meta_path):
+    """
+    Name and version from the ``package`` section of a conda-forge recipe,
+    or ``(None, None)`` if they cannot be worked out without rendering the
+    recipe.
+    """
+    with open(meta_path) as f:
+        text = f.read()
+
+    variables = dict(_JINJA_SET.findall(text))
+
+    def substitute(match):
+        value = variables.get(match.group(1))
+        if value is None:
+            raise KeyError(match.group(1))
+        return value.lower() if match.group(2) else value
+
+    package_section = _PACKAGE_SECTION.search(text)
+    if not package_section:
+        return None, None
+
+    found = {}
+    for line in package_section.group(1).splitlines():
+        key, _, value = line.strip().partition(':')
+        if key in ('name', 'version'):
+            try:
+                value = _JINJA_VARIABLE.sub(substitute, value.strip())
+            except KeyError:
+                return None, None
+            found[key] = value.strip().strip('\'"')
+
+    return found.get('name'), found.get('version')
+
+
+def index_feedstocks(feedstock_dir):
+    """
+    Index the recipes in local clones of conda-forge feedstocks.
+
+    Parameters
+    ----------
+
+    feedstock_dir : str
+        Folder containing clones of feedstocks, e.g. as made by
+        ``conda_forge_feedstock_cloner``. Each clone should be named
+        ``<package>-feedstock``.
+
+    Returns
+    -------
+
+    dict
+        Keys are conda package names; values are dictionaries whose keys are
+        versions and values are the path to the recipe folder for that
+        version.
+    """
+    pattern = os.path.join(feedstock_dir, '*-feedstock', 'recipe', 'meta.yaml')
+    index = {}
+    for meta_path in glob.glob(pattern):
+        name, version = _recipe_name_and_version(meta_path)
+        if not (name and version):
+            continue
+        index.setdefault(name.lower(), {})[version] = \
+            os.path.dirname(meta_path)
+
+    return index
+
+
+def copy_feedstock_recipe(package, recipe_dir, recipe_path):
+    """
+    Copy a recipe from a local feedstock clone to ``recipe_path``.
+
+    Feedstock recipes are jinja2 templates, which can only have python and
+    numpy restrictions injected if they happen to also be valid YAML. If
+    the package has restrictions and they cannot be added, nothing is
+    copied.
+
+    Returns
+    -------
+
+    bool
+        ``True`` if the recipe was copied.
+    """
+    shutil.copytree(recipe_dir, recipe_path)
+    if not (package.python_requirements or package.numpy_requirements):
+        return True
+
+    try:
+        inject_requirements(package, recipe_path)
+    except (yaml.YAMLError, KeyError, TypeError):
+        shutil.rmtree(recipe_path)
+        return False
+
+    return True
+
+
 def inject_requirements(package, recipe_path):
     """
     Two packages get special treatment so that restrictions on build versions,
@@ -408,66 +831,212 @@ def inject_requirements(package, recipe_path):
                   default_flow_style=False)
 
 
+def build_parser():
+    """
+    Command line parser for ``extrude_recipes``.
+    """
+    parser = ArgumentParser('command line tool for building packages.')
+    parser.add_argument('requirements',
+                        help='Path to requirements.yml')
+    parser.add_argument('--template-dir', default=TEMPLATE_FOLDER,
+                        help="Path the folder of recipe templates, if "
+                             "any. Default: '{}'".format(TEMPLATE_FOLDER))
+    parser.add_argument('--dont-copy-conda-forge', action='store_true',
+                        default=False, dest='dont_copy_conda_forge',
+                        help="Do not copy packages from conda-forge. "
+                             "Default is False.")
+    parser.add_argument('--feedstock-dir', default=None,
+                        help="Folder of local clones of conda-forge "
+                             "feedstocks. Recipes for packages not copied "
+                             "from conda-forge are taken from here, if the "
+                             "version matches, instead of running conda "
+                             "skeleton.")
+    parser.add_argument('--metrics-file', default=None,
+                        help="Write metrics for the run to this file, in "
+                             "the Prometheus text format, when the run "
+                             "ends.")
+    parser.add_argument('--platforms', nargs='+', default=None,
+                        choices=ALL_PLATFORMS + ['all'],
+                        metavar='PLATFORM',
+                        help="Make recipes for these platforms, any of {}, "
+                             "or 'all' for every platform, in one run. "
+                             "Recipes for each platform go in their own "
+                             "folder inside '{}', and packages to copy from "
+                             "conda-forge are listed in "
+                             "copy_from-<platform>.yaml. Default is just the "
+                             "platform this is running "
+                             "on.".format(', '.join(ALL_PLATFORMS),
+                                          RECIPE_FOLDER))
+    parser.add_argument('--always-skeleton', action='store_true',
+                        default=False,
+                        help="Use conda skeleton for every package without a "
+                             "recipe, instead of writing recipes for pure "
+                             "python packages from their PyPI metadata.")
+    parser.add_argument('--skeleton-timeout', type=float,
+                        default=DEFAULT_TIMEOUT,
+                        help="Seconds conda skeleton may run for one "
+                             "package before it is stopped. "
+                             "Default: {}".format(DEFAULT_TIMEOUT))
+    parser.add_argument('--skeleton-memory', type=int,
+                        default=DEFAULT_MEMORY_MB,
+                        help="Memory, in MB, conda skeleton may use for one "
+                             "package; 0 for no limit. Not enforced on "
+                             "Windows. Default: {}".format(DEFAULT_MEMORY_MB))
+    parser.add_argument('--skeleton-workers', type=int, default=1,
+                        help="Number of packages to run conda skeleton for "
+                             "at the same time. Default: 1")
+    parser.add_argument('--validate', action='store_true', default=False,
+                        help="Once the recipes are made, render each one "
+                             "for every platform, python and numpy it will "
+                             "be built for, as validate_recipes does.")
+    parser.add_argument('--snapshot-dir', default=default_snapshot_dir(),
+                        help="Folder of snapshots of conda-forge package "
+                             "information, so that only packages that have "
+                             "changed since the last run are downloaded; '' "
+                             "to not use one. "
+                             "Default: '{}'".format(default_snapshot_dir()))
+    parser.add_argument('--timings-db', default=default_timings_path(),
+                        help="Database of how long each package took in "
+                             "past runs, used to start the slowest first "
+                             "and estimate how long the run will take; '' "
+                             "to not use one. "
+                             "Default: '{}'".format(default_timings_path()))
+    return parser
+
+
 def main(args=None):
     """
     Generate recipes for packages either from recipe templates, by copying
     from conda-forge, or by using conda skeleton.
     """
     if args is None:
-        parser = ArgumentParser('command line tool for building packages.')
-        parser.add_argument('requirements',
-                            help='Path to requirements.yml')
-        parser.add_argument('--template-dir', default=TEMPLATE_FOLDER,
-                            help="Path the folder of recipe templates, if "
-                                 "any. Default: '{}'".format(TEMPLATE_FOLDER))
-        parser.add_argument('--dont-copy-conda-forge', action='store_true',
-                            default=False, dest='dont_copy_conda_forge',
-                            help="Do not copy packages from conda-forge. "
-                                 "Default is False.")
-        args = parser.parse_args()
-        template_dir = args.template_dir
-        dont_copy_conda_forge = args.dont_copy_conda_forge
-
-    packages = get_package_versions(args.requirements)
-
-    packages = [p for p in packages if p.supported_platform]
+        args = build_parser().parse_args()
+
+    try:
+        with STAGE_SECONDS.time(stage='extrude_recipes'):
+            _extrude_recipes(args)
+    except Exception:
+        FAILURES.inc(stage='extrude_recipes')
+        raise
+    finally:
+        if args.metrics_file:
+            REGISTRY.write_textfile(args.metrics_file)
+
+
+def _recipe_layout(platforms):
+    """
+    Platforms to make recipes for, and where to put the recipes and the list
+    of packages to copy from conda-forge for each platform.
+
+    Parameters
+    ----------
+
+    platforms : list of str or None
+        Platforms given on the command line. ``None`` means just the
+        platform extruder is running on, with recipes in ``RECIPE_FOLDER``;
+        ``['all']`` means every platform in ``ALL_PLATFORMS``.
+
+    Returns
+    -------
+
+    tuple
+        List of platforms, and dictionaries mapping each platform to its
+        recipe folder and to its copy-from file.
+    """
+    if platforms is None:
+        from conda import config
+
+        return ([config.subdir],
+                {config.subdir: RECIPE_FOLDER},
+                {config.subdir: 'copy_from.yaml'})
+
+    if platforms == ['all']:
+        platforms = ALL_PLATFORMS
+
+    recipe_folders = dict((p, os.path.join(RECIPE_FOLDER, p))
+                          for p in platforms)
+    copy_files = dict((p, 'copy_from-{}.yaml'.format(p)) for p in platforms)
+    return list(platforms), recipe_folders, copy_files
+
+
+def _extrude_recipes(args):
+    with timings_at(args.timings_db) as timings:
+        _make_recipes(args, timings)
+
+
+def _make_recipes(args, timings):
+    template_dir = args.template_dir
+    dont_copy_conda_forge = args.dont_copy_conda_forge
+    feedstock_dir = args.feedstock_dir
+    snapshots = open_snapshots(args.snapshot_dir, get_anaconda_api(''))
+
+    # Only needed once there is real work to do.
+    from binstar_client.errors import NotFound
+
+    platforms, recipe_folders, copy_files = _recipe_layout(args.platforms)
+
+    all_packages = PackageSet.from_requirements(args.requirements)
+
+    # Platforms each package is built for, in the order given. Everything
+    # below is done once per package; the recipe is made in the folder for
+    # the first of its platforms and copied to the others.
+    package_platforms = {}
+    for platform in platforms:
+        for name in all_packages.for_subdir(platform).conda_names:
+            package_platforms.setdefault(name, []).append(platform)
+    packages, _ = all_packages.partition(package_platforms)
+
+    def recipe_path(p):
+        return os.path.join(recipe_folders[package_platforms[p.conda_name][0]],
+                            p.conda_name)
+
+    def copy_to_other_platforms(p):
+        for platform in package_platforms[p.conda_name][1:]:
+            shutil.copytree(recipe_path(p),
+                            os.path.join(recipe_folders[platform],
+                                         p.conda_name))
 
     try:
         needs_recipe = os.listdir(template_dir)
     except OSError:
         needs_recipe = []
 
-    build_recipe = [p for p in packages if p.conda_name in needs_recipe]
-    build_not_recipe = [p for p in packages if p.conda_name not in needs_recipe]
+    build_recipe, build_not_recipe = packages.partition(needs_recipe)
 
     if build_recipe or build_not_recipe:
         os.mkdir(RECIPE_FOLDER)
+        for platform in platforms:
+            if recipe_folders[platform] != RECIPE_FOLDER:
+                os.mkdir(recipe_folders[platform])
 
     # Write recipes from templates.
     for p in build_recipe:
         print('Writing recipe for {}.'.format(p.conda_name))
-        recipe_path = os.path.join(RECIPE_FOLDER, p.conda_name)
         template_path = os.path.join(template_dir, p.conda_name)
-        os.mkdir(recipe_path)
-        templates = [d for d in os.listdir(template_path) if
-                     not d.startswith('.')]
-        for template in templates:
-            rendered = render_template(p, template, folder=template_dir)
-            with open(os.path.join(recipe_path, template), 'wt') as f:
-                f.write(rendered)
-        inject_requirements(p, recipe_path)
+        with STAGE_SECONDS.time(stage='template'):
+            os.mkdir(recipe_path(p))
+            templates = [d for d in os.listdir(template_path) if
+                         not d.startswith('.')]
+            for template in templates:
+                rendered = render_template(p, template, folder=template_dir)
+                with open(os.path.join(recipe_path(p), template), 'wt') as f:
+                    f.write(rendered)
+            inject_requirements(p, recipe_path(p))
+        copy_to_other_platforms(p)
+        RECIPES_WRITTEN.inc(source='template')
 
     # check conda-forge for a recipe, and if it is not found, add to the skeleton
     # list.
     build_skeleton = []
-    copy_from_conda_forge = {}
+    copy_from_conda_forge = dict((platform, {}) for platform in platforms)
     for p in build_not_recipe:
         # Try grabbing the recipe from conda-forge
         try:
             if dont_copy_conda_forge:
                 in_conda_forge = False
             else:
-                in_conda_forge = get_conda_forge_version(p)
+                with STAGE_SECONDS.time(stage='conda_forge_check'):
+                    in_conda_forge = get_conda_forge_version(p, snapshots)
         except NotFound:
             build_skeleton.append(p)
             continue
@@ -476,21 +1045,126 @@ def main(args=None):
                 build_skeleton.append(p)
                 continue
 
-        copy_from_conda_forge[p.conda_name] = p.required_version
+        for platform in package_platforms[p.conda_name]:
+            copy_from_conda_forge[platform][p.conda_name] = p.required_version
+        RECIPES_WRITTEN.inc(source='conda-forge')
         print("Will copy {} directly from the "
               "conda-forge channel".format(p.conda_name))
 
-    if copy_from_conda_forge:
-        with open('copy_from.yaml', 'w') as f:
-            yaml.dump(copy_from_conda_forge, f)
-
-    # Use conda skeleton to generate recipes for the simple cases
-    for p in build_skeleton:
+    if snapshots is not None:
+        snapshots.save()
+
+    for platform in platforms:
+        if copy_from_conda_forge[platform]:
+            with open(copy_files[platform], 'w') as f:
+                yaml.dump(copy_from_conda_forge[platform], f)
+
+    # Use recipes from local feedstock clones where the version matches.
+    if feedstock_dir:
+        feedstock_recipes = index_feedstocks(feedstock_dir)
+        still_need_skeleton = []
+        for p in build_skeleton:
+            versions = feedstock_recipes.get(p.conda_name, {})
+            # p.version is the latest release on PyPI if the package is not
+            # pinned; only look it up if there is a feedstock to match.
+            recipe_dir = versions.get(p.version) if versions else None
+            if (recipe_dir is not None and
+                    copy_feedstock_recipe(p, recipe_dir, recipe_path(p))):
+                print('Copied recipe for {} from {}'.format(p.conda_name,
+                                                            recipe_dir))
+                copy_to_other_platforms(p)
+                RECIPES_WRITTEN.inc(source='feedstock')
+            else:
+                still_need_skeleton.append(p)
+        build_skeleton = still_need_skeleton
+
+    # Write recipes for pure python packages straight from their metadata on
+    # PyPI, which takes milliseconds rather than the tens of seconds conda
+    # skeleton takes.
+    if not args.always_skeleton:
+        still_need_skeleton = []
+        for p in build_skeleton:
+            try:
+                with STAGE_SECONDS.time(stage='fast_recipe'):
+                    written = write_fast_recipe(p, recipe_path(p))
+            except Exception as e:
+                # e.g. PyPI still failing after retries; conda skeleton may
+                # yet manage.
+                FAILURES.inc(stage='fast_recipe')
+                print('Could not write recipe for {} from PyPI metadata, '
+                      'using conda skeleton: {}'.format(p.conda_name, e))
+                if os.path.isdir(recipe_path(p)):
+                    shutil.rmtree(recipe_path(p))
+                written = False
+            if written:
+                print('Wrote recipe for {} from PyPI '
+                      'metadata'.format(p.conda_name))
+                inject_requirements(p, recipe_path(p))
+                copy_to_other_platforms(p)
+                RECIPES_WRITTEN.inc(source='pypi-metadata')
+            else:
+                still_need_skeleton.append(p)
+        build_skeleton = still_need_skeleton
+
+    # Use conda skeleton to generate recipes for the simple cases, each in
+    # its own worker process so a misbehaving setup.py cannot stall the run.
+    # The packages that took longest last time are started first.
+    names = [p.conda_name for p in build_skeleton]
+    if timings is not None:
+        estimates = timings.estimates('skeleton', names)
+        names = longest_first(names, estimates)
+        print_estimate('skeleton', names, estimates, args.skeleton_workers)
+
+    jobs = []
+    for name in names:
+        p = packages[name]
         print('generating skeleton for {}'.format(p.conda_name))
-        recipe_destination = os.path.join(RECIPE_FOLDER, p.conda_name)
-        generate_skeleton(p, RECIPE_FOLDER)
+        jobs.append((p.conda_name,
+                     skeleton_arguments(p, os.path.dirname(recipe_path(p)))))
+
+    results = run_skeletons(jobs, timeout=args.skeleton_timeout,
+                            memory_mb=args.skeleton_memory,
+                            max_workers=args.skeleton_workers)
+
+    failures = []
+    for result in results:
+        p = packages[result.name]
+        STAGE_SECONDS.observe(result.seconds, stage='skeleton')
+        if timings is not None:
+            timings.record(result.name, 'skeleton', result.seconds,
+                           ok=result.ok)
+        if not result.ok:
+            FAILURES.inc(stage='skeleton')
+            failures.append(result)
+            if os.path.isdir(recipe_path(p)):
+                shutil.rmtree(recipe_path(p))
+            continue
+
+        inject_requirements(p, recipe_path(p))
+        copy_to_other_platforms(p)
+        RECIPES_WRITTEN.inc(source='skeleton')
+
+    errors = []
+    if failures:
+        print('\nSkeleton generation failed for {} '
+              'package(s):'.format(len(failures)))
+        for result in failures:
+            print('\n{}: {}\n{}'.format(result.name, result.reason,
+                                         result.output))
+        errors.append('Skeleton generation failed for ' +
+                      ', '.join(r.name for r in failures))
+
+    # Validate even if some skeletons failed, so that one run reports both.
+    if args.validate:
+        from .validate_recipes import validate
+
+        try:
+            validate(packages, timings=timings)
+        except RuntimeError as e:
+            errors.append(str(e))
 
-        inject_requirements(p, recipe_destination)
+    if errors:
+        raise RuntimeError('; '.join(errors))
 
 
 if __name__ == '__main__':
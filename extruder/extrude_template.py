@@ -4,8 +4,6 @@ from argparse import ArgumentParser
 import os
 import shutil
 
-from jinja2 import Environment, FileSystemLoader
-
 
 def main(args=None):
     """
@@ -23,6 +21,8 @@ def main(args=None):
                             help="Travis-CI secret containing BINSTAR_TOKEN")
         args = parser.parse_args()
 
+        from jinja2 import Environment, FileSystemLoader
+
         skeleton_base_path = os.path.dirname(os.path.abspath(__file__))
 
         skeleton_file_dir = os.path.join(skeleton_base_path,
@@ -0,0 +1,254 @@
+from __future__ import (division, print_function, absolute_import)
+
+import json
+import os
+import re
+
+from .clients import pypi_release
+
+# conda skeleton downloads each package's sdist and runs its setup.py to find
+# its requirements, which takes tens of seconds. For a pure python package
+# that publishes a wheel, the requirements PyPI has for the release come
+# from the wheel's metadata, so a recipe can be written from PyPI's metadata
+# alone in milliseconds.
+#
+# Such recipes install the wheel itself with pip rather than building the
+# sdist, whose build requirements (setup_requires, pyproject.toml), e.g.
+# setuptools_scm or astropy-helpers, are not in PyPI's metadata. pip also
+# installs the wheel's entry points.
+#
+# A recipe is only written this way when the release has a pure python
+# wheel ("none-any") and every requirement and environment marker can be
+# written in conda's terms; otherwise the caller falls back to conda
+# skeleton. The modules to import are not in PyPI's metadata, so the recipe
+# has no test section.
+
+__all__ = ['fast_recipe', 'write_fast_recipe']
+
+_REQUIREMENT = re.compile(r'^\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*'
+                          r'(\[(?P<extras>[^\]]*)\])?\s*'
+                          r'\(?(?P<spec>[^;()]*)\)?\s*'
+                          r'(;\s*(?P<marker>.*))?$')
+# One clause of a version specifier that conda can also express. Anything
+# else, e.g. a direct reference such as "@ https://...", is not.
+_SPEC_CLAUSE = re.compile(r'^(==|!=|<=|>=|<|>|~=)[A-Za-z0-9.*+!_-]+$')
+_MARKER_CLAUSE = re.compile(r'^\s*(?P<variable>\w+)\s*'
+                            r'(?P<op>==|!=|<=|>=|<|>)\s*'
+                            r'["\'](?P<value>[^"\']*)["\']\s*$')
+
+# Platforms, as named in environment markers, and the conda selector for
+# each.
+_PLATFORM_SELECTORS = {
+    ('sys_platform', 'win32'): 'win',
+    ('sys_platform', 'darwin'): 'osx',
+    ('sys_platform', 'linux'): 'linux',
+    ('sys_platform', 'linux2'): 'linux',
+    ('platform_system', 'Windows'): 'win',
+    ('platform_system', 'Darwin'): 'osx',
+    ('platform_system', 'Linux'): 'linux',
+}
+
+
+def _release_info(package):
+    """
+    PyPI's metadata for the version of ``package`` to build.
+    """
+    return pypi_release('release_data', package.pypi_name, package.version)
+
+
+def _conda_spec(spec):
+    """
+    A PEP 440 version specifier written for conda, or ``None`` if it cannot
+    be.
+    """
+    parts = []
+    for clause in spec.replace(' ', '').split(','):
+        if not clause:
+            continue
+        if _SPEC_CLAUSE.match(clause) is None:
+            return None
+        if clause.startswith('~='):
+            # ~=1.4.2 means >=1.4.2 and 1.4.*
+            version = clause[2:]
+            prefix = '.'.join(version.split('.')[:-1])
+            if not prefix:
+                return None
+            parts.extend(['>=' + version, prefix + '.*'])
+        else:
+            parts.append(clause)
+    return ','.join(parts)
+
+
+def _selector(marker, include_extras):
+    """
+    The conda selector for an environment marker, ``''`` if the
+    requirement always applies, or ``None`` if the requirement should be
+    left out. Raises ``ValueError`` if the marker cannot be written as a
+    selector.
+    """
+    if not marker:
+        return ''
+    if ' or ' in marker or '(' in marker:
+        raise ValueError(marker)
+
+    selectors = []
+    for clause in marker.split(' and '):
+        match = _MARKER_CLAUSE.match(clause)
+        if match is None:
+            raise ValueError(marker)
+        variable, op, value = match.group('variable', 'op', 'value')
+        if variable == 'extra':
+            if not include_extras:
+                return None
+        elif variable == 'python_version':
+            # Selectors write python versions as e.g. 27 or 36.
+            major, _, minor = value.partition('.')
+            selectors.append('py{}{}{}'.format(op, major,
+                                               minor.split('.')[0] or '0'))
+        elif (variable, value) in _PLATFORM_SELECTORS and op in ('==', '!='):
+            selector = _PLATFORM_SELECTORS[(variable, value)]
+            selectors.append(selector if op == '==' else 'not ' + selector)
+        else:
+            raise ValueError(marker)
+    return ' and '.join(selectors)
+
+
+def _requirement_line(requirement, include_extras):
+    """
+    A line for the requirements section of a recipe from a PEP 508
+    requirement, or ``None`` if it does not apply. Raises ``ValueError`` if
+    the requirement cannot be written for conda.
+    """
+    match = _REQUIREMENT.match(requirement)
+    if match is None:
+        raise ValueError(requirement)
+    if (match.group('extras') or '').strip():
+        # conda packages have no extras, so the extra's own requirements
+        # would be missing from the recipe.
+        raise ValueError(requirement)
+    selector = _selector(match.group('marker'), include_extras)
+    if selector is None:
+        return None
+    spec = _conda_spec(match.group('spec'))
+    if spec is None:
+        raise ValueError(requirement)
+
+    line = match.group('name').lower()
+    if spec:
+        line += ' ' + spec
+    if selector:
+        line += '  # [{}]'.format(selector)
+    return line
+
+
+def _wheel_pythons(filename):
+    """
+    Major versions of python, e.g. ``set(['2', '3'])``, a wheel is for,
+    from the python tag in its filename.
+    """
+    python_tag = filename[:-len('.whl')].split('-')[-3]
+    return set(tag[2] for tag in python_tag.split('.')
+               if tag[:2] in ('py', 'cp') and tag[2:3].isdigit())
+
+
+def _pure_wheel(files):
+    """
+    The pure python wheel among a release's files that supports the most
+    versions of python, or ``None``.
+    """
+    wheels = [f for f in files if f['packagetype'] == 'bdist_wheel' and
+              f['filename'].endswith('-none-any.whl')]
+    if not wheels:
+        return None
+    return max(wheels, key=lambda f: len(_wheel_pythons(f['filename'])))
+
+
+def fast_recipe(package):
+    """
+    The text of a ``meta.yaml`` for ``package`` made from its metadata on
+    PyPI, or ``None`` if it needs to be made with conda skeleton.
+    """
+    # Options for setup.py cannot be given to a wheel.
+    if package.numpy_compiled_extensions or package.setup_options:
+        return None
+
+    wheel = _pure_wheel(package.release_files())
+    if wheel is None:
+        return None
+    pythons = _wheel_pythons(wheel['filename'])
+    if not pythons:
+        return None
+
+    info = _release_info(package)
+    requirements = []
+    if info.get('requires_python'):
+        spec = _conda_spec(info['requires_python'])
+        if spec is None:
+            return None
+        requirements.append('python ' + spec)
+    try:
+        for requirement in info.get('requires_dist') or []:
+            line = _requirement_line(requirement, package.include_extras)
+            if line is not None:
+                requirements.append(line)
+    except ValueError:
+        return None
+
+    lines = [
+        'package:',
+        '  name: {}'.format(package.conda_name),
+        '  version: {}'.format(json.dumps(str(package.version))),
+        '',
+        'source:',
+        '  fn: {}'.format(wheel['filename']),
+        '  url: {}'.format(wheel['url']),
+        '  md5: {}'.format(wheel['md5_digest']),
+        '',
+        'build:',
+        '  number: 0',
+        '  script: pip install {} --no-deps'.format(wheel['filename']),
+    ]
+    # CI builds every package for both python 2 and 3.
+    if '2' not in pythons:
+        lines.append('  skip: True  # [py2k]')
+    if '3' not in pythons:
+        lines.append('  skip: True  # [py3k]')
+    lines.extend([
+        '',
+        'requirements:',
+        '  build:',
+        '    - python',
+        '    - pip',
+    ])
+    lines.extend('    - ' + r for r in requirements)
+    lines.extend(['  run:', '    - python'])
+    lines.extend('    - ' + r for r in requirements)
+    lines.extend(['', 'about:'])
+    for key, field in [('home', 'home_page'), ('license', 'license'),
+                       ('summary', 'summary')]:
+        value = (info.get(field) or '').strip()
+        if value and value != 'UNKNOWN':
+            lines.append('  {}: {}'.format(key, json.dumps(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def write_fast_recipe(package, recipe_path):
+    """
+    Write a recipe for ``package`` from its PyPI metadata into the folder
+    ``recipe_path``.
+
+    Returns
+    -------
+
+    bool
+        ``True`` if the recipe was written, ``False`` if it needs to be made
+        with conda skeleton instead.
+    """
+    meta = fast_recipe(package)
+    if meta is None:
+        return False
+
+    os.mkdir(recipe_path)
+    with open(os.path.join(recipe_path, 'meta.yaml'), 'w') as f:
+        f.write(meta)
+    return True
@@ -0,0 +1,81 @@
+from __future__ import (division, print_function, absolute_import)
+
+import os
+import tempfile
+from warnings import warn
+
+# Helpers for the files extruder keeps on the local machine: metrics for a
+# textfile collector, channel snapshots and the like.
+#
+# Snapshots and timings are kept in ~/.extruder by default. Both only make
+# runs faster, so if they cannot be written, e.g. in a CI container without
+# a writable home directory, they are turned off with a warning instead of
+# ending the run.
+
+__all__ = ['default_path', 'usable_folder', 'write_atomically']
+
+
+def default_path(variable, name):
+    """
+    Default location of a file or folder extruder keeps between runs:
+    ``name`` in ``~/.extruder``, unless the environment variable
+    ``variable`` is set. Setting it to an empty string turns off the
+    feature that uses it.
+    """
+    return os.environ.get(variable,
+                          os.path.join(os.path.expanduser('~'), '.extruder',
+                                       name))
+
+
+def usable_folder(folder, feature):
+    """
+    Create ``folder`` if needed and check that it can be written.
+
+    Returns
+    -------
+
+    bool
+        ``False``, after warning that ``feature`` is turned off, if the
+        folder cannot be used.
+    """
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        if not os.access(folder, os.W_OK):
+            raise OSError('{} is not writable'.format(folder))
+    except OSError as e:
+        warn('Turning off {}: {}'.format(feature, e))
+        return False
+    return True
+
+
+def write_atomically(path, text, mode=None):
+    """
+    Write ``text`` to ``path`` in one step, so that neither an interrupted
+    run nor a reader at the same time ever sees a partly written file.
+
+    Parameters
+    ----------
+
+    path : str
+        File to write, replaced if it exists.
+    text : str
+        Contents of the file.
+    mode : int, optional
+        Permissions for the file. By default it is readable only by the
+        user running extruder.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=folder,
+                                    prefix='.' + os.path.basename(path),
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        # os.replace, unlike os.rename, also overwrites on Windows.
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
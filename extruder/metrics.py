@@ -0,0 +1,250 @@
+from __future__ import (division, print_function, absolute_import)
+
+from contextlib import contextmanager
+import threading
+import time
+
+from .local_files import write_atomically
+
+# A small registry of counters and histograms that can be written out in
+# the Prometheus text exposition format, either to a file for the node
+# exporter's textfile collector at the end of a run, or served over HTTP by
+# long-running processes like the extruder daemon.
+
+__all__ = ['Counter', 'Histogram', 'Registry', 'REGISTRY']
+
+# Bucket upper bounds, in seconds, for latency histograms.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\')
+                      .replace('\n', '\\n')
+                      .replace('"', '\\"'))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v))
+                          for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Metric {} takes labels {}, got '
+                             '{}'.format(self.name, self.labelnames,
+                                         sorted(labels)))
+        return tuple((k, labels[k]) for k in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        """
+        This metric in the Prometheus text format.
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for name, labels, value in self._samples():
+            lines.append('{}{} {}'.format(name, _format_labels(labels),
+                                          _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """
+    A count that only goes up, e.g. the number of builds copied.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, e.g. how long each stage took.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key,
+                                             ([0] * len(self.buckets), 0))
+            counts = [c + (value <= bound)
+                      for c, bound in zip(counts, self.buckets)]
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe how long the body of a ``with`` statement takes, whether or
+        not it raises an exception.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0))
+            return counts[-1]
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for count, bound in zip(counts, self.buckets):
+                    labels = key + (('le', _format_value(bound)),)
+                    samples.append((self.name + '_bucket', labels, count))
+                samples.append((self.name + '_sum', key, total))
+                samples.append((self.name + '_count', key, counts[-1]))
+        return samples
+
+
+class Registry(object):
+    """
+    Collection of metrics that are exported together.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        All of the metrics in the Prometheus text format.
+        """
+        return ''.join(m.render() + '\n' for m in self._metrics)
+
+    def write_textfile(self, path):
+        """
+        Write the metrics to ``path``. The file is replaced in one step so
+        that a collector never reads a partly written file.
+        """
+        # The collector, e.g. node_exporter, may run as another user.
+        write_atomically(path, self.render(), mode=0o644)
+
+    def serve(self, port, address='127.0.0.1'):
+        """
+        Serve the metrics over HTTP on ``port`` from a background thread.
+
+        Returns
+        -------
+
+        server
+            The HTTP server; call its ``shutdown`` method to stop it.
+        """
+        from six.moves import BaseHTTPServer
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+REGISTRY = Registry()
+
+# Metrics updated by extrude_recipes and copy_packages.
+
+PACKAGES_PLANNED = REGISTRY.counter(
+    'extruder_packages_planned_total',
+    'Packages planned for copying, by destination channel.',
+    ['destination'])
+BUILDS_COPIED = REGISTRY.counter(
+    'extruder_builds_copied_total',
+    'Builds copied, by destination channel.',
+    ['destination'])
+BYTES_COPIED = REGISTRY.counter(
+    'extruder_bytes_copied_total',
+    'Size of the builds copied, by destination channel.',
+    ['destination'])
+BUILDS_REMOVED = REGISTRY.counter(
+    'extruder_builds_removed_total',
+    'Builds removed when pruning, by channel.',
+    ['channel'])
+BYTES_REMOVED = REGISTRY.counter(
+    'extruder_bytes_removed_total',
+    'Size of the builds removed when pruning, by channel.',
+    ['channel'])
+RECIPES_WRITTEN = REGISTRY.counter(
+    'extruder_recipes_written_total',
+    'Recipes written, by where the recipe came from.',
+    ['source'])
+API_CALLS = REGISTRY.counter(
+    'extruder_api_calls_total',
+    'Calls to remote services, by service and endpoint.',
+    ['service', 'endpoint'])
+RETRIES = REGISTRY.counter(
+    'extruder_retries_total',
+    'Calls to remote services that were retried, by service.',
+    ['service'])
+FAILURES = REGISTRY.counter(
+    'extruder_failures_total',
+    'Failed operations, by stage.',
+    ['stage'])
+STAGE_SECONDS = REGISTRY.histogram(
+    'extruder_stage_seconds',
+    'Time taken by each stage, per package where the stage is per package.',
+    ['stage'])
@@ -0,0 +1,240 @@
+from __future__ import (division, print_function, absolute_import)
+
+from collections import namedtuple
+import codecs
+import json
+import re
+
+# Package information from anaconda.org lists every file of every version,
+# with all of its attributes, which for heavily built packages runs to tens
+# of MB. The copy planner only needs a few fields of each file, so package
+# information is kept in a compact form: a dictionary with the keys
+# ``latest_version``, ``versions`` and ``files``, where ``files`` is a list
+# of ``PackageFile``.
+#
+# ``stream_package`` builds the compact form while the response is still
+# arriving, so the full document is never held in memory.
+
+__all__ = ['PackageFile', 'compact_package', 'stream_package']
+
+# Bytes read from the response at a time when streaming.
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'\s*')
+# Inside a string, the next character that could end it; outside a string,
+# the next character that matters for finding the end of a value.
+_STRING_SPECIAL = re.compile(r'["\\]')
+_STRUCTURE_SPECIAL = re.compile(r'["\[\]{}]')
+
+
+class PackageFile(namedtuple('PackageFile',
+                             ['basename', 'version', 'subdir', 'build',
+                              'size'])):
+    """
+    The fields of a file in a package's file listing used for planning.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_info(cls, info, intern=None):
+        """
+        Make a ``PackageFile`` from one entry of the ``files`` list returned
+        by the anaconda.org API.
+
+        ``intern`` is a dictionary used to share identical strings, such as
+        versions and subdirs, between files.
+        """
+        intern = {} if intern is None else intern
+        attrs = info.get('attrs') or {}
+        subdir = attrs.get('subdir') or info['basename'].split('/')[0]
+        version = info['version']
+        return cls(info['basename'],
+                   intern.setdefault(version, version),
+                   intern.setdefault(subdir, subdir),
+                   attrs.get('build', ''),
+                   info.get('size', 0))
+
+
+def compact_package(info):
+    """
+    The compact form of package information returned by the anaconda.org
+    API.
+    """
+    intern = {}
+    return {
+        'latest_version': info['latest_version'],
+        'versions': list(info['versions']),
+        'files': [PackageFile.from_info(f, intern) for f in info['files']],
+    }
+
+
+class _JSONStream(object):
+    """
+    Read JSON values one at a time from an iterator of text chunks, holding
+    only the unread part of the text in memory.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """
+        Read another chunk, dropping text already consumed. Returns
+        ``False`` at the end of the input.
+        """
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """
+        The next character that is not whitespace, without consuming it.
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON input')
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError('Expected {!r} in JSON input, found '
+                             '{!r}'.format(character, self.peek()))
+        self._pos += 1
+
+    def read_value(self):
+        """
+        Decode the next value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the very end of the buffer may be cut short.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def skip_value(self):
+        """
+        Skip over the next value without decoding it.
+        """
+        if self.peek() not in '[{"':
+            self.read_value()
+            return
+
+        depth = 0
+        in_string = False
+        while True:
+            pattern = _STRING_SPECIAL if in_string else _STRUCTURE_SPECIAL
+            match = pattern.search(self._buffer, self._pos)
+            if match is None or match.end() == len(self._buffer):
+                # Keep the last character in case it is a backslash whose
+                # escaped character is in the next chunk.
+                self._pos = max(self._pos, len(self._buffer) - 1)
+                if self._fill():
+                    continue
+                if match is None:
+                    raise ValueError('Unexpected end of JSON input')
+            character = match.group()
+            self._pos = match.end()
+            if in_string:
+                if character == '\\':
+                    self._pos += 1
+                else:
+                    in_string = False
+                    if depth == 0:
+                        return
+            elif character == '"':
+                in_string = True
+            elif character in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def items(self):
+        """
+        Iterate over the keys of the object that comes next, leaving the
+        stream positioned at each key's value.
+        """
+        self.expect('{')
+        while self.peek() != '}':
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self._pos += 1
+        self._pos += 1
+
+    def elements(self):
+        """
+        Iterate over the elements of the array that comes next, decoding
+        each one.
+        """
+        self.expect('[')
+        while self.peek() != ']':
+            yield self.read_value()
+            if self.peek() == ',':
+                self._pos += 1
+        self._pos += 1
+
+
+def parse_package(chunks):
+    """
+    Build the compact form of package information from the text of an
+    anaconda.org package response, given as an iterator of text chunks.
+    """
+    stream = _JSONStream(chunks)
+    package = {'latest_version': None, 'versions': [], 'files': []}
+    intern = {}
+    for key in stream.items():
+        if key == 'files':
+            package['files'] = [PackageFile.from_info(f, intern)
+                                for f in stream.elements()]
+        elif key in ('latest_version', 'versions'):
+            package[key] = stream.read_value()
+        else:
+            stream.skip_value()
+    return package
+
+
+def _decoded_chunks(response, chunk_size):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in response.iter_content(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def stream_package(api, owner, name, chunk_size=CHUNK_SIZE):
+    """
+    Fetch package information from anaconda.org and return it in compact
+    form, parsing the response as it arrives.
+
+    This does the same request as ``api.package(owner, name)`` and raises
+    the same errors, e.g. ``NotFound`` if there is no such package.
+    """
+    url = '{}/package/{}/{}'.format(api.domain, owner, name)
+    response = api.session.get(url, stream=True)
+    try:
+        api._check_response(response)
+        return parse_package(_decoded_chunks(response, chunk_size))
+    finally:
+        response.close()
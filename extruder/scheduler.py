@@ -0,0 +1,268 @@
+from __future__ import (division, print_function, absolute_import)
+
+import random
+import threading
+import time
+
+from .metrics import API_CALLS, RETRIES
+
+# Every call extruder makes to PyPI, anaconda.org or the github API goes
+# through SCHEDULER, which limits how many calls to each service are in
+# flight at once. The limit adapts: it creeps up by about one for every
+# "limit" successful calls, and is halved, with a jittered pause before the
+# next call, whenever the service throttles us (HTTP 429, 503, or a github
+# rate limit) or fails (5xx or a connection error). Throttled and failed
+# calls are retried a few times before giving up, except for calls that
+# change something, e.g. copying a package, which may have taken effect
+# before the service failed; those go through SCHEDULER.call_once.
+
+__all__ = ['HostLimiter', 'RequestScheduler', 'SCHEDULER']
+
+OK = 'ok'
+THROTTLED = 'throttled'
+ERROR = 'error'
+
+# Starting and largest number of concurrent calls for each service. github
+# asks that API clients not make concurrent requests, so it starts at one.
+SERVICE_LIMITS = {
+    'pypi': (4, 16),
+    'anaconda.org': (4, 16),
+    'github': (1, 4),
+}
+DEFAULT_LIMITS = (2, 8)
+
+# Never wait longer than this, in seconds, before retrying, however long a
+# service asks us to wait.
+MAX_DELAY = 900
+
+
+class HostLimiter(object):
+    """
+    Adaptive (additive increase, multiplicative decrease) limit on the
+    number of concurrent calls to one service.
+
+    Parameters
+    ----------
+
+    initial : int
+        Number of concurrent calls allowed to start with.
+    maximum : int
+        Largest number of concurrent calls ever allowed.
+    minimum : int, optional
+        Smallest number of concurrent calls the limit can drop to.
+    base_delay : float, optional
+        Pause, in seconds, after the first throttled or failed call. Each
+        further consecutive failure doubles it.
+    """
+    def __init__(self, initial, maximum, minimum=1, base_delay=1.0):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.base_delay = base_delay
+        self._in_flight = 0
+        self._not_before = 0
+        self._failures = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until another call is allowed, then count it as in flight.
+        """
+        with self._condition:
+            while True:
+                wait = self._not_before - time.time()
+                if wait <= 0 and self._in_flight < int(self.limit):
+                    break
+                self._condition.wait(wait if wait > 0 else None)
+            self._in_flight += 1
+
+    def release(self, outcome, retry_after=None):
+        """
+        Record how a call went and adjust the limit.
+
+        Parameters
+        ----------
+
+        outcome : str
+            One of ``OK``, ``THROTTLED`` or ``ERROR``.
+        retry_after : float, optional
+            Seconds the service asked us to wait, if it said.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if outcome == OK:
+                self._failures = 0
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                self._failures += 1
+                self.limit = max(self.minimum, self.limit / 2)
+                if retry_after is None:
+                    delay = self.base_delay * 2 ** (self._failures - 1)
+                    # Full jitter keeps clients that failed together from
+                    # retrying together.
+                    delay = random.uniform(delay / 2, delay)
+                else:
+                    delay = retry_after + random.uniform(0, self.base_delay)
+                delay = min(delay, MAX_DELAY)
+                self._not_before = max(self._not_before, time.time() + delay)
+            self._condition.notify_all()
+
+
+def _is_binstar_error(obj):
+    """
+    Whether ``obj`` is an anaconda-client error, checked without importing
+    anaconda-client.
+    """
+    return any(cls.__module__.startswith('binstar_client')
+               for cls in type(obj).__mro__)
+
+
+def _status_and_headers(obj):
+    """
+    HTTP status code and headers from an exception or response raised or
+    returned by any of the clients extruder uses, or ``(None, {})``.
+    """
+    response = getattr(obj, 'response', None)
+    status = (getattr(obj, 'status_code', None) or
+              getattr(obj, 'errcode', None) or
+              getattr(response, 'status_code', None))
+    if status is None and _is_binstar_error(obj):
+        # anaconda-client puts the status code in the exception arguments.
+        # Other exceptions may have ints there that are not status codes,
+        # e.g. the errno of an OSError.
+        status = next((a for a in obj.args if isinstance(a, int)), None)
+    headers = (getattr(obj, 'headers', None) or
+               getattr(response, 'headers', None) or {})
+    return status, headers
+
+
+def _retry_after(headers):
+    """
+    Seconds to wait before retrying, if the headers say, or ``None``.
+    """
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        pass
+
+    if headers.get('X-RateLimit-Remaining') == '0':
+        try:
+            return max(0, float(headers.get('X-RateLimit-Reset')) -
+                       time.time())
+        except (TypeError, ValueError):
+            pass
+
+    return None
+
+
+def classify(obj):
+    """
+    Decide whether the exception raised, or response returned, by a call
+    means the service is throttling us, failing, or answered normally.
+
+    Returns
+    -------
+
+    tuple
+        The outcome, one of ``OK``, ``THROTTLED`` or ``ERROR``, and the
+        number of seconds the service asked us to wait, or ``None``.
+    """
+    status, headers = _status_and_headers(obj)
+    if status is None and isinstance(obj, EnvironmentError):
+        # Connection refused, reset, timed out...
+        return ERROR, None
+
+    retry_after = _retry_after(headers)
+    if status in (429, 503):
+        return THROTTLED, retry_after
+    if status == 403 and retry_after is not None:
+        # github signals both its rate limits this way.
+        return THROTTLED, retry_after
+    if status is not None and status >= 500:
+        return ERROR, retry_after
+
+    return OK, None
+
+
+class RequestScheduler(object):
+    """
+    Run calls to remote services, limiting concurrency per service and
+    retrying calls that are throttled or fail.
+
+    Parameters
+    ----------
+
+    max_retries : int, optional
+        Number of times to retry a call before giving up.
+    """
+    def __init__(self, max_retries=5):
+        self.max_retries = max_retries
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, service):
+        """
+        The `HostLimiter` for ``service``.
+        """
+        with self._lock:
+            try:
+                return self._limiters[service]
+            except KeyError:
+                initial, maximum = SERVICE_LIMITS.get(service, DEFAULT_LIMITS)
+                limiter = HostLimiter(initial, maximum)
+                self._limiters[service] = limiter
+                return limiter
+
+    def call(self, service, endpoint, func, *args, **kwargs):
+        """
+        Call ``func(*args, **kwargs)``, which talks to ``service``, and
+        return its result.
+
+        Exceptions that do not mean the service is throttling or failing,
+        e.g. a package that does not exist, are raised straight away.
+        Others are raised once ``max_retries`` retries have failed.
+
+        Parameters
+        ----------
+
+        service : str
+            Name of the service, e.g. ``'pypi'``, used to pick its limiter.
+        endpoint : str
+            Name of the call, used only for metrics.
+        """
+        return self._call(service, endpoint, func, args, kwargs,
+                          self.max_retries)
+
+    def call_once(self, service, endpoint, func, *args, **kwargs):
+        """
+        Like `call`, but never retry. For calls that change something, e.g.
+        copying or removing a package, which may have taken effect even if
+        the service then failed, so that a retry would fail or do it twice.
+        """
+        return self._call(service, endpoint, func, args, kwargs, 0)
+
+    def _call(self, service, endpoint, func, args, kwargs, max_retries):
+        limiter = self.limiter(service)
+        attempt = 0
+        while True:
+            API_CALLS.inc(service=service, endpoint=endpoint)
+            limiter.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                outcome, retry_after = classify(e)
+                limiter.release(outcome, retry_after)
+                if outcome == OK or attempt >= max_retries:
+                    raise
+            else:
+                # Some clients return an error response instead of raising.
+                outcome, retry_after = classify(result)
+                limiter.release(outcome, retry_after)
+                if outcome == OK or attempt >= max_retries:
+                    return result
+
+            attempt += 1
+            RETRIES.inc(service=service)
+
+
+SCHEDULER = RequestScheduler()
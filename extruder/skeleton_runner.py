@@ -0,0 +1,167 @@
+from __future__ import (division, print_function, absolute_import)
+
+from collections import namedtuple
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+# conda skeleton runs each package's setup.py, which can hang, download
+# something huge or use a lot of memory. To keep one such package from
+# stalling or bloating a whole run, each skeleton is made in its own worker
+# process, in its own process group so that anything it starts can be
+# stopped with it, with a limit on its run time and, where the platform
+# allows, its memory. A worker that fails is reported and the others carry
+# on.
+
+__all__ = ['SkeletonResult', 'run_skeletons']
+
+# Seconds a worker may run before it is stopped.
+DEFAULT_TIMEOUT = 600
+# Largest address space, in MB, a worker may use. Not enforced on Windows.
+DEFAULT_MEMORY_MB = 4096
+# Seconds between SIGTERM and SIGKILL when stopping a worker.
+KILL_GRACE = 5
+# Lines of a failed worker's output included in its result.
+OUTPUT_TAIL = 20
+
+# Code run by each worker: the arguments to skeletonize come as JSON on the
+# command line, so the worker does not need to import extruder.
+_WORKER = ('import json, sys\n'
+           'from conda_build.api import skeletonize\n'
+           'arguments = json.loads(sys.argv[1])\n'
+           'skeletonize(*arguments["args"], **arguments["kwargs"])\n')
+
+SkeletonResult = namedtuple('SkeletonResult',
+                            ['name', 'ok', 'reason', 'seconds', 'output'])
+
+
+def _limit_worker(memory_mb):
+    """
+    Function run in a worker just before it starts, putting it in a new
+    process group and limiting its memory.
+    """
+    def limit():
+        os.setsid()
+        if memory_mb:
+            import resource
+
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return limit
+
+
+def _stop(process):
+    """
+    Stop a worker and everything it started.
+    """
+    if process.poll() is not None:
+        return
+
+    if os.name != 'posix':
+        process.kill()
+        process.wait()
+        return
+
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        deadline = time.time() + KILL_GRACE
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # The process group has already gone.
+        pass
+    process.wait()
+
+
+def _read_output(log):
+    log.seek(0)
+    output = log.read().decode('utf-8', 'replace')
+    log.close()
+    return output
+
+
+def run_skeletons(jobs, timeout=DEFAULT_TIMEOUT,
+                  memory_mb=DEFAULT_MEMORY_MB, max_workers=1,
+                  poll_interval=0.1):
+    """
+    Run ``conda_build.api.skeletonize`` for each job in its own worker
+    process.
+
+    Parameters
+    ----------
+
+    jobs : list of tuple
+        Each job is a name, used to identify it in the results, and a
+        dictionary with keys ``args`` and ``kwargs``, the JSON-serializable
+        arguments for ``skeletonize``.
+    timeout : float, optional
+        Seconds each worker may run before it is stopped. ``None`` means no
+        limit.
+    memory_mb : int, optional
+        Largest address space, in MB, for each worker. ``None`` or 0 means
+        no limit.
+    max_workers : int, optional
+        Number of workers to run at the same time.
+
+    Returns
+    -------
+
+    list of SkeletonResult
+        One for each job, in the order the jobs finished. The output of
+        each worker is printed when it finishes; for failed jobs the end of
+        it is also kept in the result.
+    """
+    preexec_fn = _limit_worker(memory_mb) if os.name == 'posix' else None
+    pending = list(jobs)
+    running = []
+    results = []
+    try:
+        while pending or running:
+            while pending and len(running) < max_workers:
+                name, arguments = pending.pop(0)
+                log = tempfile.TemporaryFile()
+                process = subprocess.Popen(
+                    [sys.executable, '-c', _WORKER, json.dumps(arguments)],
+                    stdout=log, stderr=subprocess.STDOUT,
+                    preexec_fn=preexec_fn)
+                running.append((name, process, log, time.time()))
+
+            still_running = []
+            for name, process, log, start in running:
+                seconds = time.time() - start
+                if process.poll() is None:
+                    if timeout is None or seconds < timeout:
+                        still_running.append((name, process, log, start))
+                        continue
+                    _stop(process)
+                    reason = 'timed out after {:.0f}s'.format(seconds)
+                elif process.returncode < 0:
+                    reason = 'killed by signal {}'.format(-process.returncode)
+                elif process.returncode > 0:
+                    reason = 'exited with status {}'.format(
+                        process.returncode)
+                else:
+                    reason = None
+
+                output = _read_output(log)
+                print(output, end='')
+                tail = '\n'.join(output.splitlines()[-OUTPUT_TAIL:])
+                results.append(SkeletonResult(name, reason is None, reason,
+                                              seconds,
+                                              '' if reason is None else tail))
+            running = still_running
+            if running:
+                time.sleep(poll_interval)
+    finally:
+        # Interrupted, e.g. by Ctrl-C: do not leave workers behind.
+        for _, process, log, _ in running:
+            _stop(process)
+            log.close()
+
+    return results
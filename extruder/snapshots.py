@@ -0,0 +1,222 @@
+from __future__ import (division, print_function, absolute_import)
+
+import json
+import os
+import threading
+import time
+
+from .local_files import (default_path, usable_folder,
+                          write_atomically)
+from .package_info import (PackageFile, compact_package, parse_package,
+                           _decoded_chunks, CHUNK_SIZE)
+from .scheduler import SCHEDULER
+
+# Package information from anaconda.org, in the compact form described in
+# extruder.package_info, kept on disk between runs. Each channel has a
+# folder holding a "packages" folder, with one JSON file per package, and
+# an index of the ETag and Last-Modified values anaconda.org sent with each.
+# Later runs ask for each package conditionally, so a package that has not
+# changed costs one small 304 response instead of its whole file listing.
+#
+# If anaconda.org sends neither header for a package it is fetched in full
+# every time, as it would be without a snapshot.
+
+__all__ = ['ChannelSnapshots', 'default_snapshot_dir', 'open_snapshots']
+
+INDEX_FILE = 'index.json'
+PACKAGE_FOLDER = 'packages'
+
+
+def default_snapshot_dir():
+    """
+    Folder of channel snapshots used when none is given on the command
+    line; see `extruder.local_files.default_path`.
+    """
+    return default_path('EXTRUDER_SNAPSHOT_DIR', 'snapshots')
+
+
+def open_snapshots(path, api, stream=False, max_age=0):
+    """
+    The `ChannelSnapshots` in ``path``, or ``None`` if ``path`` is empty,
+    which turns snapshots off, or if it cannot be written.
+    """
+    if not path or not usable_folder(path, 'channel snapshots'):
+        return None
+    return ChannelSnapshots(path, api, stream=stream, max_age=max_age)
+
+
+def _write_json(path, data):
+    write_atomically(path, json.dumps(data, separators=(',', ':')))
+
+
+class ChannelSnapshots(object):
+    """
+    On-disk snapshots of package information for anaconda.org channels,
+    brought up to date with conditional requests.
+
+    Parameters
+    ----------
+
+    root : str
+        Folder for the snapshots, created if needed.
+    api : ``binstar_client.Binstar``
+        anaconda.org API client.
+    stream : bool, optional
+        Parse changed packages as they arrive, as for `PackageCopier`.
+    max_age : float, optional
+        Seconds for which a snapshot is used without asking anaconda.org
+        whether the package has changed. The default, 0, always asks.
+    """
+    def __init__(self, root, api, stream=False, max_age=0):
+        self.root = root
+        self.api = api
+        self.stream = stream
+        self.max_age = max_age
+        self._indexes = {}
+        self._changed = set()
+        self._lock = threading.Lock()
+
+    def _folder(self, owner):
+        folder = os.path.join(self.root, owner)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        return folder
+
+    def _index(self, owner):
+        """
+        The index for ``owner``, read from disk the first time it is needed.
+        Keys are package names, values are dictionaries with keys ``etag``,
+        ``last_modified`` and ``checked``, the time anaconda.org was last
+        asked about the package.
+        """
+        try:
+            return self._indexes[owner]
+        except KeyError:
+            pass
+
+        path = os.path.join(self._folder(owner), INDEX_FILE)
+        try:
+            with open(path) as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            index = {}
+        self._indexes[owner] = index
+        return index
+
+    def _package_path(self, owner, name):
+        # In their own folder, so that a package called "index" cannot
+        # overwrite the index.
+        folder = os.path.join(self._folder(owner), PACKAGE_FOLDER)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        return os.path.join(folder, name + '.json')
+
+    def _load(self, owner, name):
+        with open(self._package_path(owner, name)) as f:
+            data = json.load(f)
+        intern = {}
+        files = []
+        for f in data['files']:
+            package_file = PackageFile(*f)
+            files.append(package_file._replace(
+                version=intern.setdefault(package_file.version,
+                                          package_file.version),
+                subdir=intern.setdefault(package_file.subdir,
+                                         package_file.subdir)))
+        data['files'] = files
+        return data
+
+    def _get(self, owner, name, headers):
+        """
+        Ask anaconda.org for a package, conditionally on ``headers``.
+
+        Returns
+        -------
+
+        tuple
+            The package in compact form, or ``None`` if it has not changed,
+            and the response headers.
+        """
+        url = '{}/package/{}/{}'.format(self.api.domain, owner, name)
+        response = self.api.session.get(url, headers=headers,
+                                        stream=self.stream)
+        try:
+            self.api._check_response(response, allowed=[200, 304])
+            if response.status_code == 304:
+                return None, response.headers
+            if self.stream:
+                package = parse_package(_decoded_chunks(response,
+                                                        CHUNK_SIZE))
+            else:
+                package = compact_package(response.json())
+            return package, response.headers
+        finally:
+            response.close()
+
+    def package(self, owner, name):
+        """
+        Package information for package ``name`` in channel ``owner``, in
+        compact form, fetched only if it has changed since the snapshot.
+
+        Raises the same errors as ``api.package``, e.g. ``NotFound``.
+        """
+        from binstar_client.errors import NotFound
+
+        with self._lock:
+            index = self._index(owner)
+            entry = index.get(name)
+        fresh = (entry is not None and
+                 time.time() - entry['checked'] < self.max_age)
+        if fresh and os.path.exists(self._package_path(owner, name)):
+            return self._load(owner, name)
+
+        headers = {}
+        if entry is not None and os.path.exists(self._package_path(owner,
+                                                                   name)):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            package, response_headers = SCHEDULER.call(
+                'anaconda.org', 'package', self._get, owner, name, headers)
+        except NotFound:
+            with self._lock:
+                if index.pop(name, None) is not None:
+                    self._changed.add(owner)
+            raise
+
+        if package is None:
+            package = self._load(owner, name)
+            # A 304 need not repeat the headers it was asked with.
+            response_headers = {
+                'ETag': response_headers.get('ETag') or entry.get('etag'),
+                'Last-Modified': (response_headers.get('Last-Modified') or
+                                  entry.get('last_modified')),
+            }
+        else:
+            _write_json(self._package_path(owner, name),
+                        dict(package, files=[list(f)
+                                             for f in package['files']]))
+
+        with self._lock:
+            index[name] = {'etag': response_headers.get('ETag'),
+                           'last_modified':
+                               response_headers.get('Last-Modified'),
+                           'checked': time.time()}
+            self._changed.add(owner)
+        return package
+
+    def save(self):
+        """
+        Write the indexes that have changed to disk. Package files are
+        written as they are fetched, but the indexes only when this is
+        called, so until then the next run will ask for those packages
+        again in full.
+        """
+        with self._lock:
+            for owner in self._changed:
+                _write_json(os.path.join(self._folder(owner), INDEX_FILE),
+                            self._indexes[owner])
+            self._changed.clear()
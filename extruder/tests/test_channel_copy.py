@@ -5,7 +5,8 @@ from os import getenv
 from binstar_client.utils import get_server_api
 from binstar_client.errors import NotFound
 
-from ..copy_packages import PackageCopier
+from ..copy_packages import (PackageCopier, ChannelPruner, OLD_VERSION,
+                             SUPERSEDED, UNSUPPORTED_PLATFORM)
 
 SOURCE = 'conda-forge'
 
@@ -99,3 +100,182 @@ def test_package_copying():
     # ...and make sure it is really gone.
     dest_wcs = api.package(DEST, 'wcsaxes')
     assert "0.9" not in dest_wcs['versions']
+
+
+class CountingAPI(object):
+    """
+    Stand-in for the anaconda.org API that serves package information from
+    a dictionary and records every call.
+    """
+    def __init__(self, channels):
+        self.channels = channels
+        self.package_calls = []
+        self.copies = []
+        self.removals = []
+
+    def package(self, owner, name):
+        self.package_calls.append((owner, name))
+        try:
+            return self.channels[owner][name]
+        except KeyError:
+            raise NotFound('not found')
+
+    def copy(self, owner, package, version, basename=None, to_owner=None):
+        self.copies.append((to_owner, package, version, basename))
+
+    def remove_release(self, owner, package, version):
+        self.removals.append((owner, package, version, None))
+
+    def remove_dist(self, owner, package, version, basename=None):
+        self.removals.append((owner, package, version, basename))
+
+
+def _fake_package(*versions):
+    return {'latest_version': versions[-1],
+            'versions': list(versions),
+            'files': [{'basename': 'linux-64/x-{}-0.tar.bz2'.format(v),
+                       'version': v} for v in versions]}
+
+
+def test_multiple_destinations(monkeypatch):
+    pytest.importorskip('conda.version')
+    from .. import copy_packages
+
+    api = CountingAPI({SOURCE: {'x': _fake_package('1.0', '2.0')},
+                       'staging': {'x': _fake_package('1.0')},
+                       'production': {'x': _fake_package('1.0', '2.0')}})
+    monkeypatch.setattr(copy_packages, 'get_anaconda_api', lambda token: api)
+
+    pc = PackageCopier(SOURCE, ['staging', 'production', 'empty'],
+                       {'x': None})
+
+    # The source is only fetched once however many destinations there are.
+    assert api.package_calls.count((SOURCE, 'x')) == 1
+    assert 'x' in pc.plans['staging']
+    assert 'x' not in pc.plans['production']
+    assert 'x' in pc.plans['empty']
+    assert pc.to_copy == pc.plans['staging']
+
+    pc.copy_packages()
+    assert sorted(api.copies) == [('empty', 'x', '2.0', None),
+                                  ('staging', 'x', '2.0', None)]
+
+
+def test_every_failed_copy_reported(monkeypatch, capsys):
+    pytest.importorskip('conda.version')
+    from .. import copy_packages
+
+    class FailingAPI(CountingAPI):
+        def copy(self, owner, package, version, basename=None,
+                 to_owner=None):
+            if to_owner != 'working':
+                raise ValueError('{} is read only'.format(to_owner))
+            super(FailingAPI, self).copy(owner, package, version,
+                                         basename=basename,
+                                         to_owner=to_owner)
+
+    api = FailingAPI({SOURCE: {'x': _fake_package('1.0', '2.0')}})
+    monkeypatch.setattr(copy_packages, 'get_anaconda_api', lambda token: api)
+
+    pc = PackageCopier(SOURCE, ['broken', 'working', 'locked'], {'x': None})
+    with pytest.raises(RuntimeError) as excinfo:
+        pc.copy_packages()
+
+    # The copies that could be made were made...
+    assert api.copies == [('working', 'x', '2.0', None)]
+    # ...and both failures are reported, not just the first.
+    assert str(excinfo.value) == '2 of 3 copies failed, of x'
+    out = capsys.readouterr()[0]
+    assert ('Copying x 2.0 (all builds) to broken failed: '
+            'ValueError: broken is read only') in out
+    assert ('Copying x 2.0 (all builds) to locked failed: '
+            'ValueError: locked is read only') in out
+
+
+def test_build_filters(monkeypatch):
+    pytest.importorskip('conda.version')
+    from .. import copy_packages
+
+    builds = [('linux-64', 'np111py27_0'), ('linux-64', 'np111py36_0'),
+              ('linux-64', 'np112py36_0'), ('win-32', 'np111py27_0'),
+              ('noarch', 'py_0')]
+    source = {'latest_version': '1.0', 'versions': ['1.0'],
+              'files': [{'basename': '{}/x-1.0-{}.tar.bz2'.format(*b),
+                         'version': '1.0',
+                         'attrs': {'subdir': b[0], 'build': b[1]}}
+                        for b in builds]}
+    dest = dict(source, files=source['files'][:1])
+    api = CountingAPI({SOURCE: {'x': source}, 'partial': {'x': dest}})
+    monkeypatch.setattr(copy_packages, 'get_anaconda_api', lambda token: api)
+
+    pc = PackageCopier(SOURCE, ['partial', 'empty'], {'x': None},
+                       platforms=['linux-64'], pythons=['36'],
+                       package_filters={'x': {'numpy': ['111']}})
+
+    expected = ['linux-64/x-1.0-np111py36_0.tar.bz2',
+                'noarch/x-1.0-py_0.tar.bz2']
+    assert pc.plans['partial'] == {'x': ('1.0', expected)}
+    # With nothing on the destination, only the builds passing the filters
+    # are copied rather than the whole version.
+    assert pc.plans['empty'] == {'x': ('1.0', expected)}
+
+
+def test_prune(monkeypatch):
+    pytest.importorskip('conda.version')
+    from .. import copy_packages
+
+    builds = [('1.0', 'linux-64', 'py27_0'), ('1.1', 'linux-64', 'py27_0'),
+              ('1.1', 'linux-64', 'py27_1'), ('1.1', 'linux-64', 'py36_0'),
+              ('1.1', 'win-32', 'py27_0'), ('1.1', 'noarch', 'py_0'),
+              ('1.10', 'linux-64', 'py27_0')]
+    files = [{'basename': '{1}/x-{0}-{2}.tar.bz2'.format(*b),
+              'version': b[0], 'size': 10,
+              'attrs': {'subdir': b[1], 'build': b[2]}}
+             for b in builds]
+    api = CountingAPI({'mine': {'x': {'latest_version': '1.10',
+                                      'versions': ['1.0', '1.1', '1.10'],
+                                      'files': files}}})
+    monkeypatch.setattr(copy_packages, 'get_anaconda_api', lambda token: api)
+
+    pruner = ChannelPruner('mine', {'x': None, 'not-there': None},
+                           keep_versions=2, drop_superseded=True,
+                           platforms=['linux-64'], batch_size=2)
+
+    removed = [(r.version, r.basename, r.reason) for r in pruner.to_remove]
+    assert removed == [
+        ('1.1', 'linux-64/x-1.1-py27_0.tar.bz2', SUPERSEDED),
+        ('1.1', 'win-32/x-1.1-py27_0.tar.bz2', UNSUPPORTED_PLATFORM),
+        ('1.0', None, OLD_VERSION),
+    ]
+    assert pruner.report().splitlines()[-1] == \
+        '3 removals from mine, freeing 30 bytes'
+
+    pruner.prune()
+    assert sorted(api.removals) == \
+        sorted(('mine', 'x', v, b) for v, b, _ in removed)
+
+    # A pinned version is kept whatever its age.
+    pruner = ChannelPruner('mine', {'x': '1.0'}, keep_versions=1)
+    assert [r.version for r in pruner.to_remove] == ['1.1']
+
+    # conda-build 3 builds have a hash that changes between rebuilds.
+    hashed = [('py36h2d5d4e5_0', 'linux-64'), ('py36h7e4ab8f_1', 'linux-64'),
+              ('py27h2d5d4e5_0', 'linux-64'), ('py36h1a2b3c4_0', 'osx-64'),
+              ('mkl_py36h0f0f0f0_0', 'linux-64')]
+    files = [{'basename': '{}/y-1.0-{}.tar.bz2'.format(subdir, build),
+              'version': '1.0', 'size': 10,
+              'attrs': {'subdir': subdir, 'build': build}}
+             for build, subdir in hashed]
+    api.channels['mine']['y'] = {'latest_version': '1.0',
+                                 'versions': ['1.0'], 'files': files}
+    pruner = ChannelPruner('mine', {'y': None}, drop_superseded=True)
+    assert [r.basename for r in pruner.to_remove] == \
+        ['linux-64/y-1.0-py36h2d5d4e5_0.tar.bz2']
+
+    # Keeping no versions would empty the channel.
+    for keep in [0, -1]:
+        with pytest.raises(ValueError):
+            ChannelPruner('mine', {'x': None}, keep_versions=keep)
+        with pytest.raises(SystemExit):
+            copy_packages.build_prune_parser().parse_args(
+                ['packages.yml', 'mine', '--keep-versions', str(keep)])
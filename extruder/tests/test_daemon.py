@@ -0,0 +1,137 @@
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+from six import StringIO
+
+pytest.importorskip('ruamel.yaml')
+
+from .. import daemon
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                                reason='needs Unix sockets')
+
+
+def _echo(job):
+    # Libraries sometimes look at stdout before writing to it.
+    assert not sys.stdout.isatty()
+    assert sys.stdout.encoding == 'utf-8'
+    with pytest.raises(io.UnsupportedOperation):
+        sys.stdout.fileno()
+    print('hello')
+    sys.stderr.write('no newline')
+    return {'arguments': len(job['arguments'])}
+
+
+def _broken(job):
+    raise ValueError('broken recipe')
+
+
+def _bad_usage(job):
+    sys.exit(2)
+
+
+def _help(job):
+    sys.exit(0)
+
+
+@pytest.fixture
+def socket_path(tmpdir, monkeypatch):
+    # Nothing needs to be warm for the stand-in jobs.
+    monkeypatch.setattr(daemon, '_warm_up', lambda: None)
+    monkeypatch.setitem(daemon._RUNNERS, 'render', _echo)
+    monkeypatch.setitem(daemon._RUNNERS, 'plan_copy', _broken)
+    monkeypatch.setitem(daemon._RUNNERS, 'copy', _bad_usage)
+    monkeypatch.setitem(daemon._RUNNERS, 'help', _help)
+
+    path = str(tmpdir.join('extruder.sock'))
+    thread = threading.Thread(target=daemon.serve, args=(path,))
+    thread.daemon = True
+    thread.start()
+    deadline = time.time() + 10
+    while not daemon._daemon_is_running(path):
+        assert time.time() < deadline, 'daemon did not start'
+        time.sleep(0.01)
+
+    yield path
+
+    try:
+        daemon.submit({'job': 'shutdown'}, socket_path=path)
+    except (socket.error, RuntimeError):
+        # The test has already shut it down.
+        pass
+    thread.join(10)
+    assert not thread.is_alive()
+    assert not os.path.exists(path)
+
+
+def _submit(job, socket_path):
+    out, err = StringIO(), StringIO()
+    result = daemon.submit(job, socket_path=socket_path, stdout=out,
+                           stderr=err)
+    return result, out.getvalue(), err.getvalue()
+
+
+def test_output_and_result(socket_path):
+    result, out, err = _submit({'job': 'render', 'arguments': ['a', 'b']},
+                               socket_path)
+    assert result == {'event': 'done', 'result': {'arguments': 2}}
+    assert out == 'hello\n'
+    # A partial line is sent when the job ends.
+    assert err == 'no newline\n'
+
+
+def test_errors(socket_path):
+    result, _, _ = _submit({'job': 'plan_copy', 'arguments': []},
+                           socket_path)
+    assert result['event'] == 'error'
+    assert result['message'] == 'broken recipe'
+    assert 'ValueError' in result['traceback']
+
+    result, _, _ = _submit({'job': 'copy', 'arguments': []}, socket_path)
+    assert result == {'event': 'error',
+                      'message': 'Job exited with status 2'}
+
+    result, _, _ = _submit({'job': 'help', 'arguments': []}, socket_path)
+    assert result == {'event': 'done', 'result': None}
+
+    result, _, _ = _submit({'job': 'nope'}, socket_path)
+    assert result == {'event': 'error', 'message': 'Unknown job nope'}
+
+    # The daemon carries on after each of those.
+    result, _, _ = _submit({'job': 'render', 'arguments': []}, socket_path)
+    assert result['event'] == 'done'
+
+
+def test_client_that_sends_nothing(socket_path, monkeypatch):
+    monkeypatch.setattr(daemon, 'REQUEST_TIMEOUT', 0.2)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    try:
+        # No newline, and the connection is left open.
+        sock.sendall(b'{"job": "render"')
+        reply = json.loads(sock.makefile('rb').readline().decode('utf-8'))
+    finally:
+        sock.close()
+    assert reply['event'] == 'error'
+    assert reply['message'].startswith('No job received')
+
+    # The daemon is free for the next client.
+    result, _, _ = _submit({'job': 'render', 'arguments': []}, socket_path)
+    assert result['event'] == 'done'
+
+
+def test_one_daemon_per_socket(socket_path):
+    with pytest.raises(RuntimeError):
+        daemon.serve(socket_path)
+
+
+def test_shutdown(socket_path):
+    result, _, _ = _submit({'job': 'shutdown'}, socket_path)
+    assert result == {'event': 'done', 'result': None}
+    # The fixture checks that the daemon stops and removes its socket.
@@ -0,0 +1,309 @@
+import os
+
+import pytest
+
+pytest.importorskip('ruamel.yaml')
+
+from .. import extrude_recipes
+from ..extrude_recipes import (index_feedstocks, get_package_versions,
+                              PackageSet, Package, ALL_PLATFORMS,
+                              _recipe_layout, build_parser, _extrude_recipes,
+                              copy_feedstock_recipe)
+from ..metrics import FAILURES
+
+FEEDSTOCK_META = """{% set name = "Astropy-Healpix" %}
+{% set version = "0.2" %}
+
+package:
+  name: {{ name|lower }}
+  version: {{ version }}
+
+source:
+  url: https://pypi.io/packages/source/a/{{ name }}/{{ name }}-{{ version }}.tar.gz
+"""
+
+PLAIN_META = """package:
+  name: sep
+  version: '1.0.3'
+
+build:
+  number: 0
+"""
+
+UNRESOLVABLE_META = """package:
+  name: {{ name }}
+  version: 1.0
+"""
+
+
+SKELETON_META = """package:
+  name: {}
+  version: '1.0'
+
+requirements:
+  build:
+    - python
+  run:
+    - python
+"""
+
+
+def _fake_run_skeletons(made):
+    """
+    Stand-in for run_skeletons that writes a minimal recipe for each job,
+    recording the name of each.
+    """
+    from ..skeleton_runner import SkeletonResult
+
+    def run_skeletons(jobs, **kwargs):
+        results = []
+        for name, arguments in jobs:
+            made.append(name)
+            recipe = os.path.join(arguments['kwargs']['output_dir'], name)
+            os.mkdir(recipe)
+            with open(os.path.join(recipe, 'meta.yaml'), 'w') as f:
+                f.write(SKELETON_META.format(name))
+            results.append(SkeletonResult(name, True, None, 0.1, ''))
+        return results
+    return run_skeletons
+
+
+def _extrude(tmpdir, monkeypatch, requirements, *options):
+    """
+    Run extrude_recipes in ``tmpdir`` without conda-forge, snapshots or
+    timings.
+    """
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('requirements.yml').write(requirements)
+    args = build_parser().parse_args(['requirements.yml',
+                                      '--dont-copy-conda-forge',
+                                      '--snapshot-dir', '',
+                                      '--timings-db', ''] + list(options))
+    _extrude_recipes(args)
+
+
+def _make_feedstock(folder, name, meta):
+    recipe = os.path.join(str(folder), name + '-feedstock', 'recipe')
+    os.makedirs(recipe)
+    with open(os.path.join(recipe, 'meta.yaml'), 'w') as f:
+        f.write(meta)
+    return recipe
+
+
+def test_index_feedstocks(tmpdir):
+    healpix = _make_feedstock(tmpdir, 'astropy-healpix', FEEDSTOCK_META)
+    sep = _make_feedstock(tmpdir, 'sep', PLAIN_META)
+    _make_feedstock(tmpdir, 'broken', UNRESOLVABLE_META)
+    # Not a feedstock, so should be ignored.
+    os.makedirs(os.path.join(str(tmpdir), 'other', 'recipe'))
+
+    index = index_feedstocks(str(tmpdir))
+
+    assert index == {'astropy-healpix': {'0.2': healpix},
+                     'sep': {'1.0.3': sep}}
+
+
+def test_package_set(tmpdir, monkeypatch):
+    # Run somewhere without recipe templates.
+    monkeypatch.chdir(str(tmpdir))
+    requirements = tmpdir.join('requirements.yml')
+    requirements.write("""
+- name: Astropy
+  version: '2.0'
+  numpy_compiled_extensions: true
+- name: ccdproc
+  version: '1.3.dev1'
+  excluded_platforms:
+    - win-32
+    - win-64
+  python: '>=3.5'
+- name: sep
+  version: 1.0
+""")
+
+    packages = PackageSet.from_requirements(str(requirements))
+    assert len(packages) == 3
+    assert packages.conda_names == ['astropy', 'ccdproc', 'sep']
+
+    on_windows = packages.for_subdir('win-64')
+    assert on_windows.conda_names == ['astropy', 'sep']
+    assert 'ccdproc' not in on_windows
+    assert 'ccdproc' in packages
+    assert packages.for_subdir('linux-aarch64').conda_names == []
+    assert len(packages.for_python('27')) == 3
+    assert packages.dev().conda_names == ['ccdproc']
+    assert packages.dev(False).for_subdir('win-64').conda_names == \
+        ['astropy', 'sep']
+
+    templated, rest = packages.partition(['sep', 'not-in-the-set'])
+    assert templated.conda_names == ['sep']
+    assert rest.conda_names == ['astropy', 'ccdproc']
+
+    # Packages made from the set match those read the usual way.
+    expected = get_package_versions(str(requirements))
+    for package, other in zip(packages, expected):
+        for attribute in ['pypi_name', 'required_version',
+                          'numpy_compiled_extensions', 'setup_options',
+                          'python_requirements', 'numpy_requirements',
+                          'include_extras', 'build_pythons']:
+            assert getattr(package, attribute) == getattr(other, attribute)
+        assert sorted(package.build_platforms) == \
+            sorted(other.build_platforms)
+
+    ccdproc = packages['ccdproc']
+    assert ccdproc.is_dev
+    assert ccdproc.python_requirements == '>=3.5'
+    with pytest.raises(KeyError):
+        on_windows['ccdproc']
+
+
+def test_recipe_layout():
+    platforms, recipe_folders, copy_files = _recipe_layout(['all'])
+    assert platforms == ALL_PLATFORMS
+    assert recipe_folders['win-64'] == os.path.join('recipes', 'win-64')
+    assert copy_files['osx-64'] == 'copy_from-osx-64.yaml'
+
+    platforms, recipe_folders, _ = _recipe_layout(['linux-64'])
+    assert platforms == ['linux-64']
+    assert recipe_folders == {'linux-64': os.path.join('recipes', 'linux-64')}
+
+
+def test_fast_recipe_failure_falls_back_to_skeleton(tmpdir, monkeypatch):
+    def pypi_down(package, recipe_path):
+        os.mkdir(recipe_path)
+        raise IOError('PyPI is down')
+
+    made = []
+    monkeypatch.setattr(extrude_recipes, 'write_fast_recipe', pypi_down)
+    monkeypatch.setattr(extrude_recipes, 'run_skeletons',
+                        _fake_run_skeletons(made))
+    failures = FAILURES.value(stage='fast_recipe')
+
+    _extrude(tmpdir, monkeypatch, """
+- name: sep
+  version: '1.0'
+""", '--platforms', 'linux-64')
+
+    assert made == ['sep']
+    assert FAILURES.value(stage='fast_recipe') == failures + 1
+    assert tmpdir.join('recipes', 'linux-64', 'sep', 'meta.yaml').check()
+
+
+def test_skeleton_failures_reported_with_validation(tmpdir, monkeypatch,
+                                                    capsys):
+    from ..skeleton_runner import SkeletonResult
+    from .. import validate_recipes
+
+    def run_skeletons(jobs, **kwargs):
+        return [SkeletonResult(name, False, 'timed out after 600s', 600,
+                               'setup.py hung') for name, _ in jobs]
+
+    def validate(packages, **kwargs):
+        raise RuntimeError('2 recipe renders failed')
+
+    monkeypatch.setattr(extrude_recipes, 'run_skeletons', run_skeletons)
+    monkeypatch.setattr(validate_recipes, 'validate', validate)
+
+    with pytest.raises(RuntimeError) as excinfo:
+        _extrude(tmpdir, monkeypatch, """
+- name: sep
+  version: '1.0'
+""", '--platforms', 'linux-64', '--always-skeleton', '--validate')
+
+    assert 'sep: timed out after 600s\nsetup.py hung' in capsys.readouterr()[0]
+    assert str(excinfo.value) == ('Skeleton generation failed for sep; '
+                                  '2 recipe renders failed')
+
+
+def test_recipes_for_several_platforms(tmpdir, monkeypatch):
+    made = []
+    monkeypatch.setattr(extrude_recipes, 'run_skeletons',
+                        _fake_run_skeletons(made))
+
+    _extrude(tmpdir, monkeypatch, """
+- name: sep
+  version: '1.0'
+- name: ccdproc
+  version: '1.3'
+  excluded_platforms:
+    - win-64
+""", '--platforms', 'linux-64', 'win-64', '--always-skeleton')
+
+    # Each recipe is made once and copied to the other platforms.
+    assert sorted(made) == ['ccdproc', 'sep']
+    recipes = tmpdir.join('recipes')
+    assert sorted(recipes.listdir()) == [recipes.join('linux-64'),
+                                         recipes.join('win-64')]
+    assert sorted(p.basename for p in recipes.join('linux-64').listdir()) == \
+        ['ccdproc', 'sep']
+    assert [p.basename for p in recipes.join('win-64').listdir()] == ['sep']
+    assert recipes.join('win-64', 'sep', 'meta.yaml').read() == \
+        recipes.join('linux-64', 'sep', 'meta.yaml').read()
+
+
+def test_unknown_platform(capsys):
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(['requirements.yml',
+                                   '--platforms', 'linux-46'])
+    assert "invalid choice: 'linux-46'" in capsys.readouterr()[1]
+
+
+def test_copy_feedstock_recipe(tmpdir):
+    sep = _make_feedstock(tmpdir.join('feedstocks'), 'sep',
+                          SKELETON_META.format('sep'))
+    healpix = _make_feedstock(tmpdir.join('feedstocks'), 'astropy-healpix',
+                              FEEDSTOCK_META)
+    tmpdir.join('feedstocks', 'sep-feedstock', 'recipe',
+                'build.sh').write('python setup.py install\n')
+
+    # The whole recipe folder is copied.
+    destination = tmpdir.join('recipes', 'sep')
+    assert copy_feedstock_recipe(Package('sep', version='1.0'), sep,
+                                 str(destination))
+    assert sorted(p.basename for p in destination.listdir()) == \
+        ['build.sh', 'meta.yaml']
+
+    # Python restrictions are added to the recipe.
+    destination = tmpdir.join('restricted', 'sep')
+    assert copy_feedstock_recipe(Package('sep', version='1.0',
+                                         python_requirements='>=3'),
+                                 sep, str(destination))
+    assert 'python >=3' in destination.join('meta.yaml').read()
+
+    # A jinja2 recipe cannot have them added, so nothing is copied.
+    destination = tmpdir.join('recipes', 'astropy-healpix')
+    assert not copy_feedstock_recipe(Package('astropy-healpix',
+                                             version='0.2',
+                                             python_requirements='>=3'),
+                                     healpix, str(destination))
+    assert not destination.check()
+
+    # An existing recipe is never overwritten...
+    with pytest.raises(OSError):
+        copy_feedstock_recipe(Package('sep', version='1.0'), sep,
+                              str(tmpdir.join('recipes', 'sep')))
+    # ...and a missing feedstock recipe is an error.
+    with pytest.raises(OSError):
+        copy_feedstock_recipe(Package('sep', version='1.0'),
+                              str(tmpdir.join('missing')),
+                              str(tmpdir.join('recipes', 'other')))
+
+
+def test_unpinned_package_from_feedstock(tmpdir, monkeypatch):
+    sep = _make_feedstock(tmpdir.join('feedstocks'), 'sep', PLAIN_META)
+    made = []
+    monkeypatch.setattr(extrude_recipes, 'run_skeletons',
+                        _fake_run_skeletons(made))
+    # The latest release on PyPI is the version the feedstock has.
+    monkeypatch.setattr(extrude_recipes, 'get_pypi_info',
+                        lambda name: '1.0.3')
+
+    _extrude(tmpdir, monkeypatch, """
+- name: sep
+""", '--platforms', 'linux-64', '--always-skeleton',
+             '--feedstock-dir', str(tmpdir.join('feedstocks')))
+
+    assert made == []
+    with open(os.path.join(sep, 'meta.yaml')) as f:
+        assert tmpdir.join('recipes', 'linux-64', 'sep',
+                           'meta.yaml').read() == f.read()
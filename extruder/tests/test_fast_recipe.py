@@ -0,0 +1,86 @@
+import pytest
+
+pytest.importorskip('ruamel.yaml')
+
+from .. import clients, fast_recipe
+from ..extrude_recipes import Package
+from ..fast_recipe import _requirement_line
+
+
+def test_requirement_line():
+    assert _requirement_line('six', False) == 'six'
+    assert _requirement_line('Numpy (>=1.7, <2)', False) == 'numpy >=1.7,<2'
+    assert _requirement_line('attrs~=17.4', False) == 'attrs >=17.4,17.*'
+    assert _requirement_line('pywin32; sys_platform == "win32"', False) == \
+        'pywin32  # [win]'
+    assert _requirement_line('enum34; python_version < "3.4"', False) == \
+        'enum34  # [py<34]'
+    assert _requirement_line('pytest; extra == "test"', False) is None
+    assert _requirement_line('pytest; extra == "test"', True) == 'pytest'
+    with pytest.raises(ValueError):
+        _requirement_line('x; platform_machine == "arm64"', False)
+    # A direct reference has no conda equivalent...
+    with pytest.raises(ValueError):
+        _requirement_line('foo @ https://example.org/foo.zip', False)
+    # ...and an extra would lose its own requirements.
+    with pytest.raises(ValueError):
+        _requirement_line('bar[baz]>=2', False)
+
+
+def _package(monkeypatch, files, info, **kwargs):
+    package = Package('Example', version='1.0', **kwargs)
+    monkeypatch.setattr(package, 'release_files', lambda: files)
+    monkeypatch.setitem(clients._pypi_releases,
+                        ('release_data', 'Example', '1.0'), info)
+    return package
+
+
+SDIST = {'packagetype': 'sdist', 'filename': 'Example-1.0.tar.gz',
+         'url': 'https://example.org/Example-1.0.tar.gz', 'md5_digest': 'a'}
+WHEEL = {'packagetype': 'bdist_wheel',
+         'filename': 'Example-1.0-py2.py3-none-any.whl',
+         'url': 'https://example.org/Example-1.0-py2.py3-none-any.whl',
+         'md5_digest': 'b'}
+PY3_WHEEL = dict(WHEEL, filename='Example-1.0-py3-none-any.whl')
+INFO = {'requires_dist': ['six>=1.9', 'pytest; extra == "test"'],
+        'requires_python': '>=2.7', 'home_page': 'https://example.org',
+        'license': 'BSD', 'summary': 'An example'}
+
+
+def test_fast_recipe(monkeypatch):
+    package = _package(monkeypatch, [SDIST, PY3_WHEEL, WHEEL], INFO)
+    meta = fast_recipe.fast_recipe(package)
+
+    assert '  version: "1.0"' in meta
+    # The wheel for both pythons is installed, not the sdist built, since
+    # the sdist's build requirements are not known.
+    assert '  url: {}'.format(WHEEL['url']) in meta
+    assert '  md5: b' in meta
+    assert ('  script: pip install Example-1.0-py2.py3-none-any.whl '
+            '--no-deps') in meta
+    assert 'skip' not in meta
+    assert meta.count('    - six >=1.9\n') == 2
+    assert meta.count('    - python >=2.7\n') == 2
+    assert 'pytest' not in meta
+    assert '  summary: "An example"' in meta
+
+
+def test_falls_back_to_skeleton(monkeypatch):
+    compiled = dict(WHEEL, filename='Example-1.0-cp36-cp36m-win32.whl')
+    assert fast_recipe.fast_recipe(
+        _package(monkeypatch, [compiled], INFO)) is None
+    assert fast_recipe.fast_recipe(
+        _package(monkeypatch, [WHEEL], INFO,
+                 numpy_compiled_extensions=True)) is None
+    assert fast_recipe.fast_recipe(
+        _package(monkeypatch, [WHEEL], INFO,
+                 setup_options='--offline')) is None
+    odd = dict(INFO, requires_dist=['x; platform_machine == "arm64"'])
+    assert fast_recipe.fast_recipe(_package(monkeypatch, [WHEEL], odd)) is None
+
+
+def test_python_3_only_wheel(monkeypatch):
+    info = dict(INFO, requires_python=None)
+    meta = fast_recipe.fast_recipe(_package(monkeypatch, [SDIST, PY3_WHEEL],
+                                            info))
+    assert '  skip: True  # [py2k]\n' in meta
@@ -0,0 +1,133 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('ruamel.yaml')
+
+from .. import conda_forge_feedstock_cloner
+from ..conda_forge_feedstock_cloner import (feedstock_status, FeedstockStatus,
+                                            fork_and_clone, repack_reference)
+
+
+class FakeResponse(object):
+    def __init__(self, payload):
+        self._payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._payload
+
+
+class FakeSession(object):
+    """
+    Answer GraphQL status queries from a dictionary of repositories, which
+    are keyed by 'owner/name'.
+    """
+    def __init__(self, repos, errors=None):
+        self.repos = repos
+        self.errors = errors
+        self.queries = []
+
+    def post(self, url, data):
+        query = json.loads(data)['query']
+        self.queries.append(query)
+        result = {}
+        errors = list(self.errors or [])
+        for line in query.splitlines():
+            if ': repository(' not in line:
+                continue
+            alias = line.split(':')[0].strip()
+            owner = line.split('owner: "')[1].split('"')[0]
+            name = line.split('name: "')[1].split('"')[0]
+            repo = self.repos.get('/'.join([owner, name]))
+            if repo is None:
+                errors.append({'type': 'NOT_FOUND'})
+            result[alias] = repo
+        return FakeResponse({'data': result, 'errors': errors})
+
+
+class FakeGitHub(object):
+    def __init__(self, session):
+        self.session = session
+
+
+def test_feedstock_status_batches():
+    repos = {
+        'conda-forge/a-feedstock': {'isEmpty': False},
+        'conda-forge/b-feedstock': {'isEmpty': True},
+        'conda-forge/c-feedstock': {'isEmpty': False},
+        'me/c-feedstock': {'isFork': True,
+                           'parent': {'nameWithOwner':
+                                      'conda-forge/c-feedstock'}},
+        # Same name, but not a fork of the conda-forge feedstock.
+        'conda-forge/d-feedstock': {'isEmpty': False},
+        'me/d-feedstock': {'isFork': False, 'parent': None},
+    }
+    feedstocks = ['a-feedstock', 'b-feedstock', 'c-feedstock',
+                  'd-feedstock', 'e-feedstock']
+    session = FakeSession(repos)
+    status = feedstock_status(FakeGitHub(session), feedstocks, 'me',
+                              batch_size=2)
+
+    assert len(session.queries) == 3
+    assert status['a-feedstock'] == FeedstockStatus(True, False, False)
+    assert status['b-feedstock'] == FeedstockStatus(True, True, False)
+    assert status['c-feedstock'] == FeedstockStatus(True, False, True)
+    assert status['d-feedstock'] == FeedstockStatus(True, False, False)
+    assert status['e-feedstock'] == FeedstockStatus(False, False, False)
+
+
+def test_feedstock_status_error():
+    session = FakeSession({}, errors=[{'type': 'RATE_LIMITED',
+                                       'message': 'slow down'}])
+    with pytest.raises(RuntimeError):
+        feedstock_status(FakeGitHub(session), ['a-feedstock'], 'me')
+
+
+def _make_feedstock(folder, owner, name):
+    import git
+    path = os.path.join(str(folder), owner, name)
+    repo = git.Repo.init(path, initial_branch='master')
+    with repo.config_writer() as config:
+        config.set_value('user', 'name', 'Test')
+        config.set_value('user', 'email', 'test@example.org')
+    with open(os.path.join(path, 'README.md'), 'w') as f:
+        f.write(name)
+    repo.index.add(['README.md'])
+    repo.index.commit('Initial commit')
+    return path
+
+
+def test_clone_with_reference(tmpdir, monkeypatch):
+    git = pytest.importorskip('git')
+    for name in ['a-feedstock', 'b-feedstock']:
+        upstream = _make_feedstock(tmpdir.join('github'), 'conda-forge', name)
+        # The fork shares the upstream history.
+        git.Repo.clone_from(upstream, str(tmpdir.join('github', 'me', name)))
+    monkeypatch.setattr(conda_forge_feedstock_cloner, 'GITHUB_CLONE_URL',
+                        os.path.join(str(tmpdir), 'github', '{}', '{}'))
+
+    status = dict((f, FeedstockStatus(True, False, True))
+                  for f in ['a-feedstock', 'b-feedstock'])
+    reference = str(tmpdir.join('store.git'))
+    destination = str(tmpdir.join('clones'))
+    fork_and_clone(None, [{'name': 'a'}, {'name': 'B'}], 'me', destination,
+                   status=status, reference=reference)
+
+    for feedstock in ['a-feedstock', 'b-feedstock']:
+        alternates = os.path.join(destination, feedstock, '.git', 'objects',
+                                  'info', 'alternates')
+        with open(alternates) as f:
+            assert f.read().strip() == os.path.join(reference, 'objects')
+
+    # git must never prune the objects the clones borrow.
+    config = git.Repo(reference).config_reader()
+    assert config.get_value('gc', 'auto') == 0
+    assert config.get_value('gc', 'pruneExpire') == 'never'
+
+    repack_reference(reference)
+    packs = os.listdir(os.path.join(reference, 'objects', 'pack'))
+    assert len([p for p in packs if p.endswith('.pack')]) == 1
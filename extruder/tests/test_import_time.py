@@ -0,0 +1,62 @@
+from __future__ import print_function
+
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('ruamel.yaml')
+
+# Cumulative import time budget, in microseconds, for each command line
+# entry point. These are generous; importing conda-build alone takes
+# several seconds, which is what these are meant to catch.
+IMPORT_BUDGETS = {
+    'extruder.extrude_recipes': 200000,
+    'extruder.copy_packages': 200000,
+    'extruder.conda_forge_feedstock_cloner': 200000,
+    'extruder.extrude_template': 100000,
+    'extruder.daemon': 200000,
+    'extruder.validate_recipes': 200000,
+    'extruder.timings': 100000,
+}
+
+# None of these should be imported just by importing an entry point.
+HEAVY_MODULES = ['conda', 'conda_build', 'binstar_client', 'jinja2',
+                 'github3', 'git']
+
+
+def _import_in_subprocess(module):
+    """
+    Import ``module`` in a fresh interpreter with ``-X importtime`` and
+    return the cumulative import time of ``module`` and the list of heavy
+    modules that were imported along with it.
+    """
+    code = ('import sys; import {}; '
+            'print(",".join(m for m in {!r} if m in sys.modules))')
+    code = code.format(module, HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    cumulative = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, _, timings = line.partition(':')
+        self_time, total, name = timings.split('|')
+        if name.strip() == module:
+            cumulative = int(total)
+    heavy = [m for m in result.stdout.strip().split(',') if m]
+    return cumulative, heavy
+
+
+@pytest.mark.parametrize('module', sorted(IMPORT_BUDGETS))
+def test_no_heavy_imports(module):
+    _, heavy = _import_in_subprocess(module)
+    assert heavy == []
+
+
+@pytest.mark.parametrize('module', sorted(IMPORT_BUDGETS))
+def test_import_time_budget(module):
+    # Take the best of a few runs to keep noise on busy machines down.
+    best = min(_import_in_subprocess(module)[0] for _ in range(3))
+    assert best < IMPORT_BUDGETS[module]
@@ -0,0 +1,60 @@
+import os
+import stat
+
+import pytest
+
+from ..metrics import Registry
+
+
+def test_render_counter_and_histogram():
+    registry = Registry()
+    calls = registry.counter('calls_total', 'Calls.', ['endpoint'])
+    seconds = registry.histogram('stage_seconds', 'Stage time.', ['stage'],
+                                 buckets=[1, 10])
+
+    calls.inc(endpoint='package')
+    calls.inc(2, endpoint='package')
+    calls.inc(endpoint='copy')
+    seconds.observe(0.5, stage='plan')
+    seconds.observe(5, stage='plan')
+
+    assert calls.value(endpoint='package') == 3
+    assert seconds.count(stage='plan') == 2
+
+    lines = registry.render().splitlines()
+    assert lines == [
+        '# HELP calls_total Calls.',
+        '# TYPE calls_total counter',
+        'calls_total{endpoint="copy"} 1.0',
+        'calls_total{endpoint="package"} 3.0',
+        '# HELP stage_seconds Stage time.',
+        '# TYPE stage_seconds histogram',
+        'stage_seconds_bucket{stage="plan",le="1.0"} 1.0',
+        'stage_seconds_bucket{stage="plan",le="10.0"} 2.0',
+        'stage_seconds_bucket{stage="plan",le="+Inf"} 2.0',
+        'stage_seconds_sum{stage="plan"} 5.5',
+        'stage_seconds_count{stage="plan"} 2.0',
+    ]
+
+
+def test_wrong_labels():
+    registry = Registry()
+    calls = registry.counter('calls_total', 'Calls.', ['endpoint'])
+    with pytest.raises(ValueError):
+        calls.inc(service='pypi')
+
+
+def test_write_textfile(tmpdir):
+    registry = Registry()
+    registry.counter('runs_total', 'Runs.').inc()
+    path = str(tmpdir.join('extruder.prom'))
+
+    registry.write_textfile(path)
+    registry.write_textfile(path)
+
+    with open(path) as f:
+        assert f.read() == registry.render()
+    assert tmpdir.listdir() == [tmpdir.join('extruder.prom')]
+    if os.name == 'posix':
+        # Readable by a collector running as another user.
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
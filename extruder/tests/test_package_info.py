@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from ..package_info import compact_package, parse_package, PackageFile
+
+PACKAGE = {
+    'name': 'x',
+    'summary': 'Tricky "strings" with \\ escapes and [brackets] {braces}',
+    'releases': [{'version': '1.0', 'distributions': [{'a': [1, 2.5e3]}]}],
+    'latest_version': '2.0',
+    'versions': ['1.0', '2.0'],
+    'files': [{'basename': 'linux-64/x-{}-py27_{}.tar.bz2'.format(v, i),
+               'version': v,
+               'size': 1000 + i,
+               'attrs': {'subdir': 'linux-64', 'build': 'py27_{}'.format(i),
+                         'depends': ['python 2.7*'] * 3}}
+              for i, v in enumerate(['1.0', '1.0', '2.0'])],
+    'watchers': 12,
+}
+
+
+def test_compact_package():
+    package = compact_package(PACKAGE)
+    assert package['latest_version'] == '2.0'
+    assert package['versions'] == ['1.0', '2.0']
+    assert package['files'][2] == PackageFile('linux-64/x-2.0-py27_2.tar.bz2',
+                                              '2.0', 'linux-64', 'py27_2',
+                                              1002)
+    # Identical strings are shared between files.
+    assert package['files'][0].version is package['files'][1].version
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 64, 100000])
+def test_parse_package_chunked(chunk_size):
+    text = json.dumps(PACKAGE, indent=1)
+    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    assert parse_package(chunks) == compact_package(PACKAGE)
+
+
+def test_parse_package_truncated():
+    text = json.dumps(PACKAGE)
+    with pytest.raises(ValueError):
+        parse_package([text[:len(text) // 2]])
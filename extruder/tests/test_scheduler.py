@@ -0,0 +1,123 @@
+import errno
+
+import pytest
+
+from ..scheduler import (classify, HostLimiter, RequestScheduler,
+                         OK, THROTTLED, ERROR)
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        super(FakeHTTPError, self).__init__(status_code)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_classify():
+    assert classify(FakeHTTPError(429)) == (THROTTLED, None)
+    assert classify(FakeHTTPError(503, {'Retry-After': '7'})) == \
+        (THROTTLED, 7.0)
+    # github's rate limits come back as 403 with rate limit headers...
+    outcome, wait = classify(FakeHTTPError(403,
+                                           {'X-RateLimit-Remaining': '0',
+                                            'X-RateLimit-Reset': '0'}))
+    assert (outcome, wait) == (THROTTLED, 0)
+    # ...but a plain 403 is an answer, not throttling.
+    assert classify(FakeHTTPError(403)) == (OK, None)
+    assert classify(FakeHTTPError(502)) == (ERROR, None)
+    assert classify(FakeHTTPError(404)) == (OK, None)
+    assert classify(IOError('connection reset')) == (ERROR, None)
+    # The errno of a network error is not an HTTP status.
+    reset = OSError(errno.ECONNRESET, 'Connection reset by peer')
+    assert classify(reset) == (ERROR, None)
+    assert classify(OSError(errno.ECONNREFUSED, 'Connection refused')) == \
+        (ERROR, None)
+    assert classify(ValueError('bug')) == (OK, None)
+    assert classify({'versions': []}) == (OK, None)
+
+
+def test_limiter_aimd():
+    limiter = HostLimiter(4, 6, base_delay=0)
+    limiter.acquire()
+    limiter.release(THROTTLED)
+    assert limiter.limit == 2
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(OK)
+    assert 3 < limiter.limit < 4
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release(OK)
+    assert limiter.limit == 6
+
+
+def _scheduler(max_retries=5):
+    scheduler = RequestScheduler(max_retries=max_retries)
+    scheduler._limiters['svc'] = HostLimiter(1, 4, base_delay=0.001)
+    return scheduler
+
+
+def test_retry_until_success():
+    results = [FakeHTTPError(429), FakeHTTPError(500), 'done']
+
+    def flaky():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert _scheduler().call('svc', 'flaky', flaky) == 'done'
+    assert results == []
+
+
+def test_no_retry_for_answers():
+    calls = []
+
+    def missing():
+        calls.append(1)
+        raise FakeHTTPError(404)
+
+    with pytest.raises(FakeHTTPError):
+        _scheduler().call('svc', 'missing', missing)
+    assert len(calls) == 1
+
+
+def test_give_up_after_retries():
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise FakeHTTPError(503)
+
+    with pytest.raises(FakeHTTPError):
+        _scheduler(max_retries=2).call('svc', 'down', down)
+    assert len(calls) == 3
+
+
+def test_retry_after_connection_reset():
+    results = [OSError(errno.ECONNRESET, 'Connection reset by peer'), 'done']
+
+    def flaky():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    scheduler = _scheduler()
+    assert scheduler.call('svc', 'flaky', flaky) == 'done'
+    assert results == []
+
+
+def test_call_once_does_not_retry():
+    calls = []
+
+    def copy():
+        calls.append(1)
+        raise FakeHTTPError(502)
+
+    scheduler = _scheduler()
+    with pytest.raises(FakeHTTPError):
+        scheduler.call_once('svc', 'copy', copy)
+    assert len(calls) == 1
+    # The failure still counts against the service.
+    assert scheduler.limiter('svc').limit == 1
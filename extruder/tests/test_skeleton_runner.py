@@ -0,0 +1,34 @@
+import sys
+
+import pytest
+
+from .. import skeleton_runner
+from ..skeleton_runner import run_skeletons
+
+# Stands in for skeletonize so the tests do not need conda-build or the
+# network.
+FAKE_WORKER = ('import json, sys, time\n'
+               'arguments = json.loads(sys.argv[1])\n'
+               'print(arguments["args"][0])\n'
+               'time.sleep(arguments["kwargs"].get("sleep", 0))\n'
+               'sys.exit(arguments["kwargs"].get("status", 0))\n')
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'),
+                    reason='process groups are POSIX only')
+def test_failures_are_reported(monkeypatch):
+    monkeypatch.setattr(skeleton_runner, '_WORKER', FAKE_WORKER)
+
+    jobs = [('fine', {'args': ['fine'], 'kwargs': {}}),
+            ('hangs', {'args': ['hangs'], 'kwargs': {'sleep': 60}}),
+            ('broken', {'args': ['broken'], 'kwargs': {'status': 3}})]
+    results = run_skeletons(jobs, timeout=2, max_workers=3)
+
+    results = dict((r.name, r) for r in results)
+    assert results['fine'].ok
+    assert not results['broken'].ok
+    assert results['broken'].reason == 'exited with status 3'
+    assert results['broken'].output == 'broken'
+    assert not results['hangs'].ok
+    assert results['hangs'].reason.startswith('timed out')
+    assert results['hangs'].seconds < 30
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+pytest.importorskip('binstar_client')
+
+from binstar_client.errors import NotFound
+
+from ..snapshots import ChannelSnapshots, open_snapshots
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = json.dumps(body) if body is not None else ''
+
+    def json(self):
+        return json.loads(self._body)
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self._body), chunk_size):
+            yield self._body[start:start + chunk_size].encode('utf-8')
+
+    def close(self):
+        pass
+
+
+class ConditionalAPI(object):
+    """
+    Stand-in for the anaconda.org API that answers conditional requests
+    for package information the way a server sending ETags would.
+    """
+    domain = 'https://api.example.org'
+
+    def __init__(self, packages):
+        self.packages = packages
+        self.requests = []
+        self.session = self
+
+    def get(self, url, headers=None, stream=False):
+        name = url.rsplit('/', 1)[-1]
+        self.requests.append((name, dict(headers or {})))
+        if name not in self.packages:
+            return FakeResponse(404)
+        etag = '"{}"'.format(self.packages[name]['latest_version'])
+        if (headers or {}).get('If-None-Match') == etag:
+            return FakeResponse(304)
+        return FakeResponse(200, self.packages[name], {'ETag': etag})
+
+    def _check_response(self, response, allowed=None):
+        if response.status_code not in (allowed or [200]):
+            raise NotFound('not found', response.status_code)
+
+
+def _package(version):
+    return {'latest_version': version, 'versions': [version],
+            'files': [{'basename': 'linux-64/x-{}-0.tar.bz2'.format(version),
+                       'version': version, 'size': 5,
+                       'attrs': {'subdir': 'linux-64', 'build': '0'}}]}
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_conditional_updates(tmpdir, stream):
+    api = ConditionalAPI({'x': _package('1.0')})
+    snapshots = ChannelSnapshots(str(tmpdir), api, stream=stream)
+    first = snapshots.package('owner', 'x')
+    snapshots.save()
+
+    # A later run reads the snapshot and only checks it is current.
+    snapshots = ChannelSnapshots(str(tmpdir), api, stream=stream)
+    assert snapshots.package('owner', 'x') == first
+    assert api.requests[-1] == ('x', {'If-None-Match': '"1.0"'})
+
+    api.packages['x'] = _package('2.0')
+    assert snapshots.package('owner', 'x')['versions'] == ['2.0']
+
+    del api.packages['x']
+    with pytest.raises(NotFound):
+        snapshots.package('owner', 'x')
+    snapshots.save()
+    with open(str(tmpdir.join('owner', 'index.json'))) as f:
+        assert json.load(f) == {}
+
+
+def test_package_called_index(tmpdir):
+    api = ConditionalAPI({'index': _package('1.0'), 'x': _package('2.0')})
+    snapshots = ChannelSnapshots(str(tmpdir), api)
+    snapshots.package('owner', 'x')
+    snapshots.package('owner', 'index')
+    snapshots.save()
+
+    # The package's snapshot does not overwrite the channel's index.
+    snapshots = ChannelSnapshots(str(tmpdir), api)
+    assert snapshots.package('owner', 'index')['versions'] == ['1.0']
+    assert snapshots.package('owner', 'x')['versions'] == ['2.0']
+    assert api.requests[-2:] == [('index', {'If-None-Match': '"1.0"'}),
+                                 ('x', {'If-None-Match': '"2.0"'})]
+
+
+def test_unusable_folder(tmpdir):
+    tmpdir.join('file').write('')
+    with pytest.warns(UserWarning):
+        assert open_snapshots(str(tmpdir.join('file', 'snapshots')),
+                              ConditionalAPI({})) is None
+    assert open_snapshots('', ConditionalAPI({})) is None
+    assert open_snapshots(str(tmpdir.join('new')),
+                          ConditionalAPI({})) is not None
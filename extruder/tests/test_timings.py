@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+from ..timings import (TimingStore, default_timings_path, estimate_makespan,
+                       longest_first, open_timings, timings_at, RECENT_RUNS)
+
+
+def test_store(tmpdir):
+    store = TimingStore(str(tmpdir.join('new', 'timings.sqlite')))
+    for seconds in [10] * RECENT_RUNS + [20] * RECENT_RUNS:
+        store.record('astropy', 'skeleton', seconds)
+    store.record('sep', 'skeleton', 1, ok=False)
+    store.record('sep', 'copy', 3)
+
+    assert store.stages() == ['copy', 'skeleton']
+    assert store.estimates('skeleton', ['astropy', 'sep', 'other']) == \
+        {'astropy': 20, 'sep': 1}
+    assert store.slowest('skeleton') == [('astropy', 2 * RECENT_RUNS, 20, 1),
+                                         ('sep', 1, 1, None)]
+
+
+def test_timings_at_closes(tmpdir):
+    path = str(tmpdir.join('timings.sqlite'))
+    with timings_at(path) as store:
+        store.record('sep', 'copy', 3)
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.stages()
+
+    with TimingStore(path) as store:
+        assert store.estimates('copy', ['sep']) == {'sep': 3}
+
+    with timings_at('') as store:
+        assert store is None
+
+
+def test_unusable_path(tmpdir):
+    tmpdir.join('file').write('')
+    # Somewhere that cannot be written turns recording off, with a warning.
+    with pytest.warns(UserWarning):
+        assert open_timings(str(tmpdir.join('file', 'timings.sqlite'))) is \
+            None
+    with pytest.warns(UserWarning):
+        assert open_timings(str(tmpdir)) is None
+
+
+def test_default_path(monkeypatch):
+    monkeypatch.setenv('EXTRUDER_TIMINGS_DB', '/somewhere/timings.sqlite')
+    assert default_timings_path() == '/somewhere/timings.sqlite'
+    # An empty value turns recording off by default.
+    monkeypatch.setenv('EXTRUDER_TIMINGS_DB', '')
+    assert default_timings_path() == ''
+    monkeypatch.delenv('EXTRUDER_TIMINGS_DB')
+    assert default_timings_path().endswith('timings.sqlite')
+
+
+def test_longest_first():
+    estimates = {'slow': 100, 'fast': 1, 'medium': 10}
+    # Unknown jobs are placed as if they took the average.
+    assert longest_first(['fast', 'new', 'medium', 'slow'], estimates) == \
+        ['slow', 'new', 'medium', 'fast']
+
+
+def test_estimate_makespan():
+    assert estimate_makespan([10, 6, 5, 4], 2) == 14
+    assert estimate_makespan([10, 6, 5, 4], 1) == 25
+    assert estimate_makespan([], 4) == 0
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+pytest.importorskip('ruamel.yaml')
+
+from ..extrude_recipes import PackageSet
+from ..validate_recipes import (RenderTask, RenderResult, _recipe_for,
+                                render_tasks, report)
+
+
+def _make_recipe(*parts):
+    os.makedirs(os.path.join(*parts))
+    with open(os.path.join(os.path.join(*parts), 'meta.yaml'), 'w') as f:
+        f.write('package:\n  name: x\n')
+
+
+def test_recipe_for(tmpdir):
+    recipes = str(tmpdir)
+    _make_recipe(recipes, 'sep')
+    _make_recipe(recipes, 'win-64', 'astropy')
+
+    assert _recipe_for(recipes, 'sep', 'linux-64') == \
+        os.path.join(recipes, 'sep')
+    assert _recipe_for(recipes, 'astropy', 'win-64') == \
+        os.path.join(recipes, 'win-64', 'astropy')
+    # Recipes made for one platform are not used for another.
+    assert _recipe_for(recipes, 'astropy', 'osx-64') is None
+
+
+def test_render_tasks(tmpdir, monkeypatch):
+    version = pytest.importorskip('conda.version')
+    if not hasattr(version, 'VersionSpec'):
+        pytest.skip('needs a conda with conda.version.VersionSpec')
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('requirements.yml').write("""
+- name: ccdproc
+  version: '1.3'
+  python: '>=3'
+- name: Astropy
+  version: '2.0'
+  numpy_compiled_extensions: true
+  numpy_build_restrictions: '>=1.12'
+- name: sep
+  version: '1.0'
+""")
+    recipes = str(tmpdir.join('recipes'))
+    for name in ['ccdproc', 'astropy']:
+        _make_recipe(recipes, name)
+
+    packages = PackageSet.from_requirements('requirements.yml')
+    tasks = [t for t in render_tasks(packages, recipe_dir=recipes,
+                                     numpys=['1.11', '1.12', '1.13'])
+             if t.subdir == 'linux-64']
+
+    # No recipe for sep, e.g. because it is copied from conda-forge.
+    assert set(t.package for t in tasks) == set(['ccdproc', 'astropy'])
+    # A python 3 only package is not rendered for python 2.7...
+    assert [(t.python, t.numpy) for t in tasks
+            if t.package == 'ccdproc'] == [('3.5', None)]
+    # ...and one with compiled extensions is rendered for each numpy it
+    # allows with each python.
+    assert sorted((t.python, t.numpy) for t in tasks
+                  if t.package == 'astropy') == \
+        [('2.7', '1.12'), ('2.7', '1.13'), ('3.5', '1.12'), ('3.5', '1.13')]
+
+
+def test_report():
+    ok = RenderTask('sep', 'recipes/sep', 'linux-64', '3.5', None)
+    bad = RenderTask('astropy', 'recipes/astropy', 'win-32', '2.7', '1.11')
+    results = [RenderResult(ok, None, 1.0),
+               RenderResult(bad, 'RuntimeError: no compiler', 2.0)]
+
+    assert report(results).splitlines() == [
+        'astropy on win-32, python 2.7, numpy 1.11: RuntimeError: no '
+        'compiler',
+        '1 of 2 renders failed',
+    ]
@@ -0,0 +1,284 @@
+from __future__ import (division, print_function, absolute_import)
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+import heapq
+import os
+import threading
+import time
+from warnings import warn
+
+from .local_files import default_path, usable_folder
+
+# How long each package took in each stage (skeleton, template, render,
+# copy) of past runs, kept in a local SQLite database. Parallel stages use it
+# to start the packages expected to take longest first, which keeps one slow
+# package started last from setting the length of the whole run, and to
+# estimate how long the stage will take.
+#
+# sqlite3 is imported when a database is opened.
+
+__all__ = ['TimingStore', 'default_timings_path', 'open_timings',
+           'timings_at', 'longest_first', 'estimate_makespan']
+
+# Number of most recent runs averaged to estimate how long the next will
+# take, and compared with the runs before them to show a trend.
+RECENT_RUNS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS timings (
+    package TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    finished REAL NOT NULL,
+    seconds REAL NOT NULL,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_package_stage
+    ON timings (package, stage, finished);
+"""
+
+
+def default_timings_path():
+    """
+    Path of the timing database used when none is given on the command
+    line; see `extruder.local_files.default_path`.
+    """
+    return default_path('EXTRUDER_TIMINGS_DB', 'timings.sqlite')
+
+
+def open_timings(path):
+    """
+    The `TimingStore` at ``path``, or ``None`` if ``path`` is empty, which
+    turns recording off, or if the database cannot be opened.
+    """
+    if not path:
+        return None
+
+    import sqlite3
+
+    if not usable_folder(os.path.dirname(os.path.abspath(path)),
+                         'timing recording'):
+        return None
+    try:
+        return TimingStore(path)
+    except sqlite3.Error as e:
+        warn('Turning off timing recording: {}'.format(e))
+        return None
+
+
+@contextmanager
+def timings_at(path):
+    """
+    `open_timings` as a context manager, which closes the store at the end,
+    so that a long-lived process such as the daemon does not keep a
+    database open for every run.
+    """
+    store = open_timings(path)
+    try:
+        yield store
+    finally:
+        if store is not None:
+            store.close()
+
+
+class TimingStore(object):
+    """
+    Durations and outcomes of each stage of each package.
+
+    Parameters
+    ----------
+
+    path : str
+        Path of the SQLite database, which is created if needed.
+    """
+    def __init__(self, path):
+        import sqlite3
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.path = path
+        # Copies are recorded from several threads.
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30,
+                                           check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, package, stage, seconds, ok=True):
+        """
+        Record that ``stage`` took ``seconds`` for ``package``.
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    'INSERT INTO timings VALUES (?, ?, ?, ?, ?)',
+                    (package, stage, time.time(), seconds,
+                     'ok' if ok else 'failed'))
+
+    def _durations(self, stage, package=None):
+        """
+        Durations for ``stage``, oldest first, as a dictionary keyed by
+        package.
+        """
+        query = 'SELECT package, seconds FROM timings WHERE stage = ?'
+        parameters = [stage]
+        if package is not None:
+            query += ' AND package = ?'
+            parameters.append(package)
+        query += ' ORDER BY finished'
+
+        durations = {}
+        with self._lock:
+            for name, seconds in self._connection.execute(query, parameters):
+                durations.setdefault(name, []).append(seconds)
+        return durations
+
+    def estimates(self, stage, packages):
+        """
+        Expected duration of ``stage`` for each of ``packages``, from the
+        average of its most recent runs. Packages never run are left out.
+        """
+        wanted = set(packages)
+        estimates = {}
+        for name, seconds in self._durations(stage).items():
+            if name in wanted:
+                recent = seconds[-RECENT_RUNS:]
+                estimates[name] = sum(recent) / len(recent)
+        return estimates
+
+    def stages(self):
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT DISTINCT stage FROM timings ORDER BY stage')
+            return [stage for stage, in rows]
+
+    def slowest(self, stage, limit=10):
+        """
+        The packages that have recently taken longest in ``stage``.
+
+        Returns
+        -------
+
+        list of tuple
+            ``(package, runs, recent, change)``, slowest first, where
+            ``recent`` is the average of the most recent runs and
+            ``change`` is the fractional change from the runs before them,
+            or ``None`` if there were none.
+        """
+        rows = []
+        for name, seconds in self._durations(stage).items():
+            recent = seconds[-RECENT_RUNS:]
+            earlier = seconds[-2 * RECENT_RUNS:-RECENT_RUNS]
+            recent_mean = sum(recent) / len(recent)
+            change = None
+            if earlier:
+                earlier_mean = sum(earlier) / len(earlier)
+                if earlier_mean:
+                    change = recent_mean / earlier_mean - 1
+            rows.append((name, len(seconds), recent_mean, change))
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows[:limit]
+
+
+def longest_first(names, estimates):
+    """
+    ``names`` ordered by expected duration, longest first. Names with no
+    estimate are treated as taking the average of those with one.
+    """
+    names = list(names)
+    known = [estimates[n] for n in names if n in estimates]
+    default = sum(known) / len(known) if known else 0
+    return sorted(names, key=lambda n: estimates.get(n, default),
+                  reverse=True)
+
+
+def estimate_makespan(durations, workers):
+    """
+    How long jobs with the given durations will take to run on ``workers``
+    workers, each job starting on whichever worker is free first, in the
+    order given.
+    """
+    finish_times = [0] * max(1, workers)
+    for seconds in durations:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + seconds)
+    return max(finish_times)
+
+
+def print_estimate(stage, names, estimates, workers):
+    """
+    Print the estimated length of a stage, if anything is known about it.
+    """
+    if not estimates:
+        return
+    known = [estimates[n] for n in names if n in estimates]
+    default = sum(known) / len(known)
+    seconds = estimate_makespan([estimates.get(n, default) for n in names],
+                                workers)
+    print('Estimated time for {} stage: {}'.format(stage,
+                                                   _format_seconds(seconds)))
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{}h{:02d}m{:02d}s'.format(hours, minutes, seconds)
+    if minutes:
+        return '{}m{:02d}s'.format(minutes, seconds)
+    return '{}s'.format(seconds)
+
+
+def build_parser():
+    """
+    Command line parser for ``extruder_stats``.
+    """
+    parser = ArgumentParser('Show the packages that take longest in each '
+                            'stage of extrude_recipes and copy_packages, '
+                            'and how that has changed.')
+    parser.add_argument('--timings-db', default=default_timings_path(),
+                        help="Timing database. "
+                             "Default: '{}'".format(default_timings_path()))
+    parser.add_argument('--stage', default=None,
+                        help="Only show this stage, e.g. skeleton or copy. "
+                             "Default is every stage.")
+    parser.add_argument('--limit', type=int, default=10,
+                        help="Number of packages to show for each stage. "
+                             "Default: 10")
+    return parser
+
+
+def main(args=None):
+    args = build_parser().parse_args(args)
+
+    if not args.timings_db:
+        print('Timing recording is turned off')
+        return
+    if not os.path.exists(args.timings_db):
+        print('No timings recorded yet in {}'.format(args.timings_db))
+        return
+
+    with TimingStore(args.timings_db) as store:
+        stages = [args.stage] if args.stage else store.stages()
+        for stage in stages:
+            print('\n{}'.format(stage))
+            print('  {:<30} {:>5} {:>10} {:>8}'.format('package', 'runs',
+                                                       'recent', 'trend'))
+            for name, runs, recent, change in store.slowest(stage,
+                                                            args.limit):
+                trend = '' if change is None else '{:+.0%}'.format(change)
+                print('  {:<30} {:>5} {:>10} {:>8}'.format(
+                    name, runs, _format_seconds(recent), trend))
+
+
+if __name__ == '__main__':
+    main()
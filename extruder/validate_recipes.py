@@ -0,0 +1,272 @@
+from __future__ import (division, print_function, absolute_import)
+
+from argparse import ArgumentParser
+from collections import namedtuple
+import multiprocessing
+import os
+import sys
+import time
+
+from ruamel import yaml
+from six import StringIO
+
+from .extrude_recipes import PackageSet, RECIPE_FOLDER
+from .metrics import REGISTRY, FAILURES, STAGE_SECONDS
+from .timings import (default_timings_path, longest_first, timings_at,
+                      print_estimate)
+
+# A recipe that renders on the machine that made it can still fail to render
+# on a CI worker for another platform, python or numpy, e.g. because of a
+# selector or a jinja2 expression. Rendering every recipe for every
+# combination it will be built for catches that in seconds, instead of
+# minutes into a CI job.
+#
+# conda and conda-build are imported in the worker processes that use them.
+
+__all__ = ['RenderTask', 'RenderResult', 'render_tasks', 'render_matrix',
+           'validate']
+
+# Versions of numpy to render packages with compiled extensions for, unless
+# the package restricts them.
+DEFAULT_NUMPYS = ['1.11', '1.12', '1.13']
+
+RenderTask = namedtuple('RenderTask',
+                        ['package', 'recipe', 'subdir', 'python', 'numpy'])
+RenderResult = namedtuple('RenderResult', ['task', 'error', 'seconds'])
+
+
+def _dotted(python):
+    """
+    Python version written as in a build string, e.g. ``'27'``, written
+    the usual way, e.g. ``'2.7'``.
+    """
+    return python if '.' in python else python[0] + '.' + python[1:]
+
+
+def _recipe_for(recipe_dir, name, subdir):
+    """
+    Path to the recipe for package ``name`` on ``subdir``, allowing for
+    recipes made with ``extrude_recipes --platforms``, or ``None``.
+    """
+    for path in [os.path.join(recipe_dir, subdir, name),
+                 os.path.join(recipe_dir, name)]:
+        if os.path.isfile(os.path.join(path, 'meta.yaml')):
+            return path
+    return None
+
+
+def render_tasks(packages, recipe_dir=RECIPE_FOLDER, numpys=DEFAULT_NUMPYS):
+    """
+    Every (platform, python, numpy) combination to render each recipe for.
+
+    Parameters
+    ----------
+
+    packages : iterable of Package
+        Packages to render recipes for. Packages without a recipe in
+        ``recipe_dir``, e.g. those copied from conda-forge, are skipped.
+    recipe_dir : str, optional
+        Folder of recipes made by ``extrude_recipes``.
+    numpys : list of str, optional
+        Versions of numpy to render packages with compiled extensions for.
+        Versions excluded by a package's numpy restrictions are left out.
+
+    Returns
+    -------
+
+    list of RenderTask
+    """
+    from conda.version import VersionSpec
+
+    tasks = []
+    for p in packages:
+        pythons = [_dotted(py) for py in p.build_pythons]
+        if p.python_requirements:
+            spec = VersionSpec(p.python_requirements)
+            pythons = [py for py in pythons if spec.match(py)]
+
+        if p.numpy_compiled_extensions:
+            package_numpys = list(numpys)
+            if p.numpy_requirements:
+                spec = VersionSpec(p.numpy_requirements)
+                package_numpys = [np for np in package_numpys
+                                  if spec.match(np)]
+        else:
+            package_numpys = [None]
+
+        for subdir in p.build_platforms:
+            recipe = _recipe_for(recipe_dir, p.conda_name, subdir)
+            if recipe is None:
+                continue
+            for python in pythons:
+                for numpy in package_numpys:
+                    tasks.append(RenderTask(p.conda_name, recipe, subdir,
+                                            python, numpy))
+    return tasks
+
+
+def _render_one(task):
+    """
+    Render one recipe for one combination, in a worker process.
+    """
+    import conda_build
+    from conda_build.api import render
+
+    platform, arch = task.subdir.split('-')
+    kwargs = {'platform': platform, 'arch': arch, 'python': task.python}
+    if task.numpy is not None:
+        kwargs['numpy'] = task.numpy
+    if int(conda_build.__version__.split('.')[0]) >= 3:
+        # Do not check that the build environment could be solved; only
+        # conda-build 3 has this option.
+        kwargs['bypass_env_check'] = True
+
+    # conda-build is chatty; only its errors are of interest here.
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StringIO()
+    start = time.time()
+    try:
+        render(task.recipe, **kwargs)
+    except (Exception, SystemExit) as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    else:
+        error = None
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+    return RenderResult(task, error, time.time() - start)
+
+
+def render_matrix(tasks, max_workers=None):
+    """
+    Render each task in a pool of worker processes.
+
+    Returns
+    -------
+
+    list of RenderResult
+        In the same order as ``tasks``.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not tasks:
+        return []
+
+    max_workers = max_workers or multiprocessing.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_render_one, tasks))
+
+
+def report(results):
+    """
+    Describe the renders that failed, ending with a total.
+    """
+    lines = []
+    failed = [r for r in results if r.error is not None]
+    for r in failed:
+        t = r.task
+        lines.append('{} on {}, python {}{}: {}'.format(
+            t.package, t.subdir, t.python,
+            '' if t.numpy is None else ', numpy ' + t.numpy, r.error))
+    lines.append('{} of {} renders failed'.format(len(failed), len(results)))
+    return '\n'.join(lines)
+
+
+def validate(packages, recipe_dir=RECIPE_FOLDER, numpys=DEFAULT_NUMPYS,
+             max_workers=None, report_file=None, timings=None):
+    """
+    Render every recipe for every combination it will be built for, print
+    a report, and raise an error if any render failed.
+
+    Parameters
+    ----------
+
+    report_file : str, optional
+        Also write the failures to this file, as a yaml list.
+    timings : `extruder.timings.TimingStore`, optional
+        If given, the packages that took longest to render in past runs
+        are rendered first, and the time to render each combination is
+        recorded.
+    """
+    tasks = render_tasks(packages, recipe_dir=recipe_dir, numpys=numpys)
+    print('Rendering {} recipe combinations'.format(len(tasks)))
+    if timings is not None:
+        estimates = timings.estimates('render', set(t.package for t in tasks))
+        order = longest_first(range(len(tasks)),
+                              dict((i, estimates[t.package])
+                                   for i, t in enumerate(tasks)
+                                   if t.package in estimates))
+        tasks = [tasks[i] for i in order]
+        print_estimate('render', [t.package for t in tasks], estimates,
+                       max_workers or multiprocessing.cpu_count())
+
+    with STAGE_SECONDS.time(stage='validate'):
+        results = render_matrix(tasks, max_workers=max_workers)
+    if timings is not None:
+        for r in results:
+            timings.record(r.task.package, 'render', r.seconds,
+                           ok=r.error is None)
+    print(report(results))
+
+    failed = [r for r in results if r.error is not None]
+    if report_file:
+        with open(report_file, 'w') as f:
+            yaml.safe_dump([dict(r.task._asdict(), error=r.error)
+                            for r in failed],
+                           f, default_flow_style=False)
+    if failed:
+        FAILURES.inc(len(failed), stage='validate')
+        raise RuntimeError('{} recipe renders failed'.format(len(failed)))
+
+    return results
+
+
+def build_parser():
+    """
+    Command line parser for ``validate_recipes``.
+    """
+    parser = ArgumentParser('Render recipes made by extrude_recipes for '
+                            'every platform, python and numpy they will be '
+                            'built for.')
+    parser.add_argument('requirements',
+                        help='Path to requirements.yml')
+    parser.add_argument('--recipe-dir', default=RECIPE_FOLDER,
+                        help="Folder of recipes. "
+                             "Default: '{}'".format(RECIPE_FOLDER))
+    parser.add_argument('--numpy', nargs='+', default=DEFAULT_NUMPYS,
+                        help="Versions of numpy to render packages with "
+                             "compiled extensions for. "
+                             "Default: {}".format(' '.join(DEFAULT_NUMPYS)))
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help="Number of recipes to render at once. Default "
+                             "is the number of CPUs.")
+    parser.add_argument('--report', default=None,
+                        help="Also write the failed renders to this file, "
+                             "as yaml.")
+    parser.add_argument('--timings-db', default=default_timings_path(),
+                        help="Database of how long each package took in "
+                             "past runs; '' to not use one. "
+                             "Default: '{}'".format(default_timings_path()))
+    parser.add_argument('--metrics-file', default=None,
+                        help="Write metrics for the run to this file, in "
+                             "the Prometheus text format, when the run "
+                             "ends.")
+    return parser
+
+
+def main(args=None):
+    args = build_parser().parse_args(args)
+
+    try:
+        with timings_at(args.timings_db) as timings:
+            validate(PackageSet.from_requirements(args.requirements),
+                     recipe_dir=args.recipe_dir, numpys=args.numpy,
+                     max_workers=args.max_workers, report_file=args.report,
+                     timings=timings)
+    finally:
+        if args.metrics_file:
+            REGISTRY.write_textfile(args.metrics_file)
+
+
+if __name__ == '__main__':
+    main()